@@ -0,0 +1,107 @@
+"""Задержка event loop при конкурентных записях в SQLite.
+
+Сравнивает синхронные вызовы Database прямо из корутин (как раньше делали
+обработчики) и асинхронный фасад AsyncDatabase. Параллельно работает
+"конкурирующий писатель" в отдельном потоке, периодически удерживающий
+блокировку записи - так имитируется медленная запись или ожидание блокировки.
+
+Запуск из корня репозитория:
+    python benchmarks/db_event_loop_lag.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py создает глобальный экземпляр bot.db в текущей папке
+WORK_DIR = tempfile.mkdtemp(prefix="db-bench-")
+os.chdir(WORK_DIR)
+
+from database import Database, AsyncDatabase  # noqa: E402
+
+WRITERS = 20
+WRITES_PER_WRITER = 50
+TICK = 0.005
+LOCK_HOLD = 0.02
+
+
+def hold_write_lock(db_path: str, stop: threading.Event):
+    """Периодически удерживать блокировку записи в отдельном соединении"""
+    import sqlite3
+    conn = sqlite3.connect(db_path, timeout=30)
+    while not stop.is_set():
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(LOCK_HOLD)
+        conn.commit()
+        time.sleep(LOCK_HOLD)
+    conn.close()
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    """Насколько позже запланированного просыпается корутина"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def run(mode: str) -> dict:
+    db_path = os.path.join(WORK_DIR, f"{mode}.db")
+    database = Database(db_path)
+    async_db = AsyncDatabase(database)
+    
+    stop_lock = threading.Event()
+    locker = threading.Thread(target=hold_write_lock, args=(db_path, stop_lock))
+    locker.start()
+    
+    async def writer(n: int):
+        for i in range(WRITES_PER_WRITER):
+            telegram_id = n * 10000 + i
+            if mode == "sync":
+                database.add_user(telegram_id, f"user{telegram_id}")
+                database.update_user_royale_info(telegram_id, f"nick{telegram_id}", f"TAG{telegram_id}")
+            else:
+                await async_db.add_user(telegram_id, f"user{telegram_id}")
+                await async_db.update_user_royale_info(telegram_id, f"nick{telegram_id}", f"TAG{telegram_id}")
+            await asyncio.sleep(0)
+    
+    stop = asyncio.Event()
+    lags: list = []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(WRITERS)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    
+    stop_lock.set()
+    locker.join()
+    async_db.close()
+    database.close()
+    
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "max": lags[-1] * 1000,
+        "p99": lags[int(len(lags) * 0.99) - 1] * 1000,
+        "p50": lags[len(lags) // 2] * 1000,
+    }
+
+
+async def main():
+    print(f"{WRITERS} писателей x {WRITES_PER_WRITER} x 2 записи, блокировка {LOCK_HOLD * 1000:.0f} мс\n")
+    for mode in ("sync", "async"):
+        result = await run(mode)
+        print(
+            f"{mode:>5}: всего {result['elapsed']:.2f} с | задержка loop "
+            f"p50 {result['p50']:.1f} мс, p99 {result['p99']:.1f} мс, max {result['max']:.1f} мс"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
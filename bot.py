@@ -5,8 +5,14 @@ from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from config import BOT_TOKEN
 from handlers import commands, war_commands, members, admin_panel, roles
+from middlewares.reachability import ReachabilityMiddleware
 from utils.war_reminders import WarReminderService
-from database import db
+from utils.cr_api import cr_api
+from utils.royaleapi import royale_api
+from utils.clan_snapshot import clan_snapshot
+from utils.telegram_session import telegram_session
+from utils.broadcast_jobs import broadcast_worker
+from database import db, async_db
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,12 +32,21 @@ async def main():
         return
     
     # Инициализация бота и диспетчера
+    # Все запросы к Telegram идут через общую очередь с приоритетами
     bot = Bot(
         token=BOT_TOKEN,
+        session=telegram_session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     dp = Dispatcher()
     
+    # Открываем общие HTTP-сессии для внешних API
+    await cr_api.start()
+    await royale_api.start()
+    
+    # Фоновое обновление снимка клана
+    clan_snapshot.start()
+    
     # Инициализация сервиса напоминаний
     global war_reminder_service
     war_reminder_service = WarReminderService(bot)
@@ -41,11 +56,19 @@ async def main():
     import handlers.war_commands as wc
     wc.war_reminder_service = war_reminder_service
     
+    # Фоновые рассылки (прерванные при остановке продолжаются)
+    broadcast_worker.start(bot)
+    
     # Инициализация первого админа (если база пуста)
-    admins = db.get_all_admins()
+    admins = await async_db.get_all_admins()
     if not admins:
         logger.warning("⚠️ В базе нет админов! Используйте /addadmin для добавления первого админа.")
     
+    # Снятие и установка отметки недоступности для рассылок
+    reachability = ReachabilityMiddleware()
+    dp.message.outer_middleware(reachability)
+    dp.my_chat_member.outer_middleware(reachability)
+    
     # Регистрация роутеров
     dp.include_router(commands.router)
     dp.include_router(war_commands.router)
@@ -58,8 +81,14 @@ async def main():
     try:
         await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        await broadcast_worker.stop()
         war_reminder_service.stop()
+        await clan_snapshot.stop()
+        await cr_api.close()
+        await royale_api.close()
         await bot.session.close()
+        async_db.close()
+        db.close()
 
 
 if __name__ == "__main__":
@@ -12,15 +12,95 @@ CR_API_TOKEN = os.getenv("CR_API_TOKEN", "")
 # Clash Royale API Base URL
 CR_API_BASE_URL = "https://api.clashroyale.com/v1"
 
+# Параметры HTTP-клиента Clash Royale API
+CR_API_TIMEOUT = float(os.getenv("CR_API_TIMEOUT", "10"))  # общий таймаут запроса, сек
+CR_API_CONNECT_TIMEOUT = float(os.getenv("CR_API_CONNECT_TIMEOUT", "5"))  # таймаут соединения, сек
+CR_API_POOL_SIZE = int(os.getenv("CR_API_POOL_SIZE", "20"))  # максимум keep-alive соединений
+CR_API_DNS_CACHE_TTL = int(os.getenv("CR_API_DNS_CACHE_TTL", "300"))  # кэш DNS, сек
+CR_API_KEEPALIVE_TIMEOUT = float(os.getenv("CR_API_KEEPALIVE_TIMEOUT", "60"))  # простой соединения, сек
+
+# Лимит запросов к Clash Royale API (под квоту ключа разработчика)
+CR_API_RATE_LIMIT = float(os.getenv("CR_API_RATE_LIMIT", "10"))  # запросов в секунду
+CR_API_BURST = int(os.getenv("CR_API_BURST", "20"))  # максимальный всплеск запросов
+CR_API_MAX_RETRIES = int(os.getenv("CR_API_MAX_RETRIES", "3"))  # повторов при 429/5xx
+CR_API_RETRY_BASE_DELAY = float(os.getenv("CR_API_RETRY_BASE_DELAY", "1"))  # сек
+CR_API_RETRY_MAX_DELAY = float(os.getenv("CR_API_RETRY_MAX_DELAY", "30"))  # сек
+CR_API_BULK_CONCURRENCY = int(os.getenv("CR_API_BULK_CONCURRENCY", "8"))  # параллельных запросов в массовых выборках
+
+# Circuit breaker для Clash Royale API
+CR_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CR_BREAKER_FAILURE_THRESHOLD", "5"))  # ошибок подряд
+CR_BREAKER_RESET_TIMEOUT = int(os.getenv("CR_BREAKER_RESET_TIMEOUT", "60"))  # пауза, сек
+
+# Кэш ответов Clash Royale API (время жизни записей в секундах)
+CR_CACHE_MAX_ENTRIES = int(os.getenv("CR_CACHE_MAX_ENTRIES", "512"))
+CR_CACHE_TTL_CLAN = int(os.getenv("CR_CACHE_TTL_CLAN", "300"))
+CR_CACHE_TTL_MEMBERS = int(os.getenv("CR_CACHE_TTL_MEMBERS", "60"))
+CR_CACHE_TTL_WAR = int(os.getenv("CR_CACHE_TTL_WAR", "30"))
+CR_CACHE_TTL_PLAYER = int(os.getenv("CR_CACHE_TTL_PLAYER", "600"))
+CR_CACHE_TTL_BATTLELOG = int(os.getenv("CR_CACHE_TTL_BATTLELOG", "120"))
+
+# Через сколько секунд без ответа официального API для /player
+# параллельно запрашивается RoyaleAPI (примерно p95 задержки API)
+PLAYER_HEDGE_DELAY = float(os.getenv("PLAYER_HEDGE_DELAY", "1.5"))
+
+# Фоновое обновление снимка клана (интервалы в секундах)
+SNAPSHOT_INTERVAL_WAR = int(os.getenv("SNAPSHOT_INTERVAL_WAR", "30"))  # день битвы
+SNAPSHOT_INTERVAL_COLLECTION = int(os.getenv("SNAPSHOT_INTERVAL_COLLECTION", "120"))  # день сбора карт
+SNAPSHOT_INTERVAL_IDLE = int(os.getenv("SNAPSHOT_INTERVAL_IDLE", "300"))  # нет войны
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", "900"))  # старше - команда ждет обновления
+
 # RoyaleAPI Base URL
 ROYALEAPI_BASE_URL = "https://royaleapi.com"
 
+# Пул для разбора HTML-страниц RoyaleAPI вне event loop
+ROYALEAPI_PARSER_WORKERS = int(os.getenv("ROYALEAPI_PARSER_WORKERS", "2"))
+# 1 - разбирать в отдельных процессах (обходит GIL), 0 - в потоках
+ROYALEAPI_PARSER_PROCESSES = os.getenv("ROYALEAPI_PARSER_PROCESSES", "0") == "1"
+
+# Дисковый кэш разобранных страниц RoyaleAPI (переживает перезапуск бота)
+ROYALEAPI_CACHE_PATH = os.getenv("ROYALEAPI_CACHE_PATH", "royaleapi_cache.db")
+ROYALEAPI_CACHE_TTL = int(os.getenv("ROYALEAPI_CACHE_TTL", "1800"))  # сек
+ROYALEAPI_CACHE_MAX_ENTRIES = int(os.getenv("ROYALEAPI_CACHE_MAX_ENTRIES", "2000"))
+
 # Clan Tag (без #)
 CLAN_TAG = os.getenv("CLAN_TAG", "")
 
+# Настройки SQLite
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))  # кэш страниц на соединение
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))  # байт
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))  # подготовленных запросов
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))  # ожидание блокировки, сек
+DB_READER_THREADS = int(os.getenv("DB_READER_THREADS", "4"))  # потоков для чтения
+DB_USER_CACHE_SIZE = int(os.getenv("DB_USER_CACHE_SIZE", "1024"))  # пользователей в кэше
+DB_USER_CACHE_TTL = int(os.getenv("DB_USER_CACHE_TTL", "300"))  # сек
+
+# Общая очередь исходящих запросов к Telegram: лимиты Telegram - около 30 сообщений
+# в секунду на бота, 1 в секунду в личный чат, 20 в минуту в группу
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", "30"))  # запросов в секунду
+TELEGRAM_BURST = int(os.getenv("TELEGRAM_BURST", "10"))
+TELEGRAM_PRIVATE_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PRIVATE_CHAT_INTERVAL", "1"))  # сек
+TELEGRAM_GROUP_CHAT_INTERVAL = float(os.getenv("TELEGRAM_GROUP_CHAT_INTERVAL", "3"))  # сек
+TELEGRAM_MAX_FLOOD_WAIT = float(os.getenv("TELEGRAM_MAX_FLOOD_WAIT", "60"))  # дольше - ошибка вызывающему
+TELEGRAM_FLOOD_RETRIES = int(os.getenv("TELEGRAM_FLOOD_RETRIES", "2"))  # повторов после flood control
+
+# Рассылки: свой лимит ниже общего, чтобы оставался запас для ответов пользователям
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # сообщений в секунду
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", "5"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))  # одновременных отправок
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))  # повторов при временных ошибках
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # сек между обновлениями прогресса
+
 # Время напоминаний об атаках (по умолчанию за 2 часа до окончания дня войны)
 WAR_REMINDER_HOURS = int(os.getenv("WAR_REMINDER_HOURS", "22"))  # 22:00 по умолчанию
 
+# Сбор атак участников КВ в базу, интервалы в секундах
+WAR_COLLECTOR_INTERVAL_WAR = int(os.getenv("WAR_COLLECTOR_INTERVAL_WAR", "120"))  # день битвы
+WAR_COLLECTOR_INTERVAL_COLLECTION = int(os.getenv("WAR_COLLECTOR_INTERVAL_COLLECTION", "600"))  # день сбора карт
+WAR_COLLECTOR_INTERVAL_IDLE = int(os.getenv("WAR_COLLECTOR_INTERVAL_IDLE", "1800"))  # нет войны
+
+# Сколько дней хранить подробную историю атак в КВ (старые записи сворачиваются в итоги сезона)
+WAR_ATTACKS_RETENTION_DAYS = int(os.getenv("WAR_ATTACKS_RETENTION_DAYS", "90"))
+
 # ID супер-администратора (может добавлять других админов)
 SUPER_ADMIN_ID = 1811574692
 
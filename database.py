@@ -1,16 +1,56 @@
+import asyncio
+import functools
+import json
 import sqlite3
 import logging
-from typing import Optional, List, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, FrozenSet, Iterable, Optional, List, Dict, Set, Tuple
 from contextlib import contextmanager
+from utils.cache import TTLCache
+from utils.json_codec import json_loads
+from utils.models import normalize_nickname, normalize_tag
+from config import (
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_STATEMENT_CACHE_SIZE, DB_BUSY_TIMEOUT, DB_READER_THREADS,
+    DB_USER_CACHE_SIZE, DB_USER_CACHE_TTL
+)
 
 logger = logging.getLogger(__name__)
 
+# Сколько значений передавать в одном запросе IN (...)
+QUERY_CHUNK_SIZE = 500
+
+# Фильтры пользователей для выборок и рассылок
+USER_FILTER_ALL = "all"
+USER_FILTER_LINKED = "linked"
+
+# Фильтр -> условие WHERE
+_USER_FILTERS = {
+    USER_FILTER_ALL: "1",
+    USER_FILTER_LINKED: "royale_nickname IS NOT NULL AND royale_tag IS NOT NULL",
+}
+
+# Пользователи, которым бот не может писать (заблокировали бота, удалены, не начинали чат),
+# по умолчанию исключаются из рассылок
+_REACHABLE = "unreachable_at IS NULL"
+
 
 class Database:
     """Класс для работы с базой данных"""
     
     def __init__(self, db_path: str = "bot.db"):
         self.db_path = db_path
+        # Постоянное соединение на каждый поток (sqlite3 не разделяет соединение между потоками)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # Кэш админов и строк пользователей; сбрасывается при записи.
+        # Поколение защищает от записи в кэш данных, прочитанных до изменения.
+        self._cache_lock = threading.Lock()
+        self._admins: Optional[FrozenSet[int]] = None
+        self._admins_generation = 0
+        self._users = TTLCache(DB_USER_CACHE_SIZE)
+        self._users_generation = 0
         self._init_db()
     
     def _init_db(self):
@@ -27,9 +67,32 @@ class Database:
                     royale_tag TEXT,
                     role TEXT DEFAULT 'member',
                     joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    royale_tag_norm TEXT,
+                    unreachable_at TIMESTAMP,
+                    royale_nickname_norm TEXT
                 )
             """)
+            self._migrate_royale_tag_norm(cursor)
+            self._migrate_unreachable_at(cursor)
+            self._migrate_royale_nickname_norm(cursor)
+            # Канонический тег уникален: один тег - один пользователь
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_users_royale_tag_norm
+                ON users(royale_tag_norm)
+            """)
+            # Поиск по нику без учета регистра: NOCASE в SQLite не понимает кириллицу,
+            # поэтому ник приводится к нижнему регистру в Python (royale_nickname_norm)
+            cursor.execute("DROP INDEX IF EXISTS idx_users_royale_nickname")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_royale_nickname_norm
+                ON users(royale_nickname_norm)
+            """)
+            # Частичный индекс: недоступных пользователей немного, индекс по ним маленький
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_unreachable
+                ON users(unreachable_at) WHERE unreachable_at IS NOT NULL
+            """)
             
             # Таблица админов
             cursor.execute("""
@@ -40,30 +103,310 @@ class Database:
                 )
             """)
             
-            # Таблица истории атак в КВ
+            # История атак в КВ: одна строка на игрока и день войны.
+            # Первичный ключ (player_tag, war_date) покрывает историю игрока.
+            self._rename_legacy_war_attacks(cursor)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS war_attacks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER,
-                    war_date DATE,
-                    attacks_count INTEGER DEFAULT 0,
+                    player_tag TEXT NOT NULL,
+                    war_date DATE NOT NULL,
+                    battles_played INTEGER NOT NULL DEFAULT 0,
+                    battles_remaining INTEGER,  -- NULL: неизвестно (перенесено из старой схемы)
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (telegram_id) REFERENCES users(telegram_id)
+                    PRIMARY KEY (player_tag, war_date)
+                ) WITHOUT ROWID
+            """)
+            # Покрывающий индекс для "кто не атаковал в день X"
+            # (в WITHOUT ROWID таблице индекс уже содержит player_tag)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_war_attacks_date
+                ON war_attacks(war_date, battles_remaining, battles_played)
+            """)
+            self._migrate_legacy_war_attacks(cursor)
+            
+            # Итоги по сезонам для записей старше срока хранения
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS war_attacks_season (
+                    player_tag TEXT NOT NULL,
+                    season TEXT NOT NULL,
+                    war_days INTEGER NOT NULL DEFAULT 0,
+                    battles_played INTEGER NOT NULL DEFAULT 0,
+                    battles_missed INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (player_tag, season)
+                ) WITHOUT ROWID
+            """)
+            
+            self._init_stats_counters(cursor)
+            
+            # Задания рассылки и состояние доставки каждому получателю
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    created_by INTEGER,
+                    status_chat_id INTEGER,
+                    status_message_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    attempts INTEGER NOT NULL DEFAULT 0
                 )
             """)
+            self._migrate_broadcast_job_attempts(cursor)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status
+                ON broadcast_jobs(status, id)
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                    job_id INTEGER NOT NULL,
+                    telegram_id INTEGER NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    extra TEXT,
+                    PRIMARY KEY (job_id, telegram_id)
+                ) WITHOUT ROWID
+            """)
+            # Выборка оставшихся получателей и подсчет прогресса по состояниям
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_state
+                ON broadcast_recipients(job_id, state)
+            """)
             
             conn.commit()
             logger.info("База данных инициализирована")
     
+    def _init_stats_counters(self, cursor: sqlite3.Cursor):
+        """Счетчики для статистики, которые поддерживаются триггерами"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        
+        # Начальные значения считаются один раз, дальше их меняют только триггеры
+        linked = "royale_nickname IS NOT NULL AND royale_tag IS NOT NULL"
+        cursor.execute("INSERT OR IGNORE INTO stats_counters SELECT 'users_total', COUNT(*) FROM users")
+        cursor.execute(f"INSERT OR IGNORE INTO stats_counters SELECT 'users_linked', COUNT(*) FROM users WHERE {linked}")
+        cursor.execute("INSERT OR IGNORE INTO stats_counters SELECT 'admins_total', COUNT(*) FROM admins")
+        
+        new_linked = "(NEW.royale_nickname IS NOT NULL AND NEW.royale_tag IS NOT NULL)"
+        old_linked = "(OLD.royale_nickname IS NOT NULL AND OLD.royale_tag IS NOT NULL)"
+        cursor.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_users_count_insert AFTER INSERT ON users BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'users_total';
+                UPDATE stats_counters SET value = value + {new_linked} WHERE name = 'users_linked';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS trg_users_count_delete AFTER DELETE ON users BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'users_total';
+                UPDATE stats_counters SET value = value - {old_linked} WHERE name = 'users_linked';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS trg_users_count_update
+            AFTER UPDATE OF royale_nickname, royale_tag ON users BEGIN
+                UPDATE stats_counters SET value = value + {new_linked} - {old_linked}
+                WHERE name = 'users_linked';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS trg_admins_count_insert AFTER INSERT ON admins BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'admins_total';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS trg_admins_count_delete AFTER DELETE ON admins BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'admins_total';
+            END;
+        """)
+    
+    def _migrate_royale_tag_norm(self, cursor: sqlite3.Cursor):
+        """Добавить и заполнить колонку royale_tag_norm в старой базе"""
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(users)")}
+        if "royale_tag_norm" in columns:
+            return
+        
+        cursor.execute("ALTER TABLE users ADD COLUMN royale_tag_norm TEXT")
+        rows = cursor.execute("""
+            SELECT telegram_id, royale_tag FROM users
+            WHERE royale_tag IS NOT NULL
+            ORDER BY last_activity DESC, telegram_id DESC
+        """).fetchall()
+        
+        # При дубликатах канонический тег получает пользователь с самой свежей
+        # активностью; у остальных ник и тег не трогаем, royale_tag_norm остается NULL
+        owners: Dict[str, int] = {}
+        normalized = []
+        duplicates: Dict[str, List[int]] = {}
+        for row in rows:
+            tag = normalize_tag(row["royale_tag"])
+            if not tag:
+                continue
+            if tag in owners:
+                duplicates.setdefault(tag, [owners[tag]]).append(row["telegram_id"])
+                continue
+            owners[tag] = row["telegram_id"]
+            normalized.append((tag, tag, row["telegram_id"]))
+        
+        cursor.executemany(
+            "UPDATE users SET royale_tag = ?, royale_tag_norm = ? WHERE telegram_id = ?",
+            normalized
+        )
+        for tag, user_ids in duplicates.items():
+            logger.warning(
+                f"Миграция тегов: тег #{tag} указан у нескольких пользователей {user_ids}; "
+                f"он закреплен за {user_ids[0]}, остальным нужно проверить ник командой /setnick"
+            )
+        logger.info(f"Миграция тегов: заполнено {len(normalized)} канонических тегов")
+    
+    def _migrate_royale_nickname_norm(self, cursor: sqlite3.Cursor):
+        """Добавить и заполнить колонку royale_nickname_norm в старой базе"""
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(users)")}
+        if "royale_nickname_norm" in columns:
+            return
+        
+        cursor.execute("ALTER TABLE users ADD COLUMN royale_nickname_norm TEXT")
+        rows = cursor.execute(
+            "SELECT telegram_id, royale_nickname FROM users WHERE royale_nickname IS NOT NULL"
+        ).fetchall()
+        cursor.executemany(
+            "UPDATE users SET royale_nickname_norm = ? WHERE telegram_id = ?",
+            [(normalize_nickname(row["royale_nickname"]) or None, row["telegram_id"]) for row in rows]
+        )
+        logger.info(f"Миграция ников: заполнено {len(rows)} ников для поиска")
+    
+    def _migrate_broadcast_job_attempts(self, cursor: sqlite3.Cursor):
+        """Добавить счетчик неудачных попыток в старую таблицу broadcast_jobs"""
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(broadcast_jobs)")}
+        if "attempts" not in columns:
+            cursor.execute("ALTER TABLE broadcast_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    
+    def _migrate_unreachable_at(self, cursor: sqlite3.Cursor):
+        """Добавить колонку unreachable_at в старой базе"""
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(users)")}
+        if "unreachable_at" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN unreachable_at TIMESTAMP")
+    
+    def _rename_legacy_war_attacks(self, cursor: sqlite3.Cursor):
+        """Убрать с дороги старую таблицу war_attacks (по telegram_id, с дубликатами)"""
+        columns = {row["name"] for row in cursor.execute("PRAGMA table_info(war_attacks)")}
+        if "telegram_id" in columns:
+            cursor.execute("ALTER TABLE war_attacks RENAME TO war_attacks_legacy")
+    
+    def _migrate_legacy_war_attacks(self, cursor: sqlite3.Cursor):
+        """Перенести записи старой таблицы war_attacks в новую схему"""
+        legacy = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'war_attacks_legacy'"
+        ).fetchone()
+        if not legacy:
+            return
+        
+        # Из дубликатов берем последнюю запись. Сколько битв осталось, старая схема
+        # не хранила, поэтому battles_remaining = NULL (неизвестно), а не 0.
+        cursor.execute("""
+            INSERT INTO war_attacks (player_tag, war_date, battles_played, battles_remaining, updated_at)
+            SELECT u.royale_tag_norm, wa.war_date, wa.attacks_count, NULL, wa.updated_at
+            FROM war_attacks_legacy wa
+            JOIN users u ON u.telegram_id = wa.telegram_id
+            WHERE wa.id IN (
+                SELECT MAX(id) FROM war_attacks_legacy GROUP BY telegram_id, war_date
+            )
+            AND u.royale_tag_norm IS NOT NULL AND wa.war_date IS NOT NULL
+        """)
+        migrated = cursor.rowcount
+        
+        # Записи без тега игрока или даты перенести нельзя - старую таблицу сохраняем
+        unmapped = cursor.execute("""
+            SELECT wa.telegram_id FROM war_attacks_legacy wa
+            LEFT JOIN users u ON u.telegram_id = wa.telegram_id
+            WHERE u.royale_tag_norm IS NULL OR wa.war_date IS NULL
+        """).fetchall()
+        if unmapped:
+            cursor.execute("ALTER TABLE war_attacks_legacy RENAME TO war_attacks_legacy_backup")
+            user_ids = sorted({row[0] for row in unmapped})
+            logger.warning(
+                f"Миграция war_attacks: {len(unmapped)} записей не перенесено (нет тега игрока или даты), "
+                f"пользователи: {user_ids}. Старая таблица сохранена как war_attacks_legacy_backup"
+            )
+        else:
+            cursor.execute("DROP TABLE war_attacks_legacy")
+        logger.info(f"Миграция war_attacks: перенесено {migrated} записей")
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть соединение с настроенными PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL: читатели не блокируют писателя и наоборот
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL безопасен и не делает fsync на каждый коммит
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
     @contextmanager
     def _get_connection(self):
-        """Контекстный менеджер для подключения к БД"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """Контекстный менеджер для постоянного соединения текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
         try:
             yield conn
-        finally:
-            conn.close()
+        except Exception:
+            # Не оставляем незавершенную транзакцию в постоянном соединении
+            conn.rollback()
+            raise
+    
+    def close(self):
+        """Закрыть все соединения (вызывается при остановке бота)"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+    
+    def _invalidate_users(self, *telegram_ids: int):
+        """Сбросить кэш строк пользователей после изменения"""
+        with self._cache_lock:
+            self._users_generation += 1
+            for telegram_id in telegram_ids:
+                self._users.invalidate(telegram_id)
+    
+    def _invalidate_admins(self):
+        """Сбросить кэш списка админов после изменения"""
+        with self._cache_lock:
+            self._admins_generation += 1
+            self._admins = None
+    
+    def _admin_ids(self) -> FrozenSet[int]:
+        """Множество ID админов (из кэша или из базы)"""
+        with self._cache_lock:
+            if self._admins is not None:
+                return self._admins
+            generation = self._admins_generation
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT telegram_id FROM admins")
+            admins = frozenset(row[0] for row in cursor.fetchall())
+        
+        with self._cache_lock:
+            if generation == self._admins_generation:
+                self._admins = admins
+        return admins
+    
+    def cache_stats(self) -> Dict[str, int]:
+        """Счетчики кэша пользователей"""
+        with self._cache_lock:
+            return self._users.stats()
     
     def add_user(self, telegram_id: int, username: Optional[str] = None):
         """Добавить пользователя"""
@@ -75,38 +418,93 @@ class Database:
             """, (telegram_id, username))
             conn.commit()
     
-    def update_user_royale_info(self, telegram_id: int, royale_nickname: str, royale_tag: str):
-        """Обновить информацию о нике и теге в рояле"""
+    def update_user_royale_info(self, telegram_id: int, royale_nickname: str, royale_tag: str) -> bool:
+        """Обновить информацию о нике и теге в рояле.
+        
+        Возвращает False, если тег уже привязан к другому пользователю.
+        """
+        clean_tag = normalize_tag(royale_tag)
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE users 
-                SET royale_nickname = ?, royale_tag = ?, last_activity = CURRENT_TIMESTAMP
-                WHERE telegram_id = ?
-            """, (royale_nickname, royale_tag, telegram_id))
+            try:
+                cursor.execute("""
+                    UPDATE users 
+                    SET royale_nickname = ?, royale_nickname_norm = ?, royale_tag = ?, royale_tag_norm = ?,
+                        last_activity = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ?
+                """, (royale_nickname, normalize_nickname(royale_nickname) or None, clean_tag,
+                      clean_tag or None, telegram_id))
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                return False
             conn.commit()
+        self._invalidate_users(telegram_id)
+        return True
     
     def get_user(self, telegram_id: int) -> Optional[Dict]:
         """Получить информацию о пользователе"""
+        with self._cache_lock:
+            user = self._users.get(telegram_id)
+            generation = self._users_generation
+        if user is not None:
+            # Копия, чтобы изменения вызывающего кода не попали в кэш
+            return dict(user)
+        
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
             row = cursor.fetchone()
-            if row:
-                return dict(row)
+        if row is None:
             return None
+        
+        user = dict(row)
+        with self._cache_lock:
+            if generation == self._users_generation:
+                self._users.set(telegram_id, user, DB_USER_CACHE_TTL)
+        return dict(user)
     
     def get_user_by_royale_tag(self, royale_tag: str) -> Optional[Dict]:
         """Найти пользователя по тегу в Clash Royale"""
-        clean_tag = royale_tag.replace("#", "").upper()
+        clean_tag = normalize_tag(royale_tag)
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE UPPER(REPLACE(royale_tag, '#', '')) = ?", (clean_tag,))
+            cursor.execute("SELECT * FROM users WHERE royale_tag_norm = ?", (clean_tag,))
             row = cursor.fetchone()
             if row:
                 return dict(row)
             return None
     
+    def get_users_by_royale_tags(self, royale_tags: Iterable[str]) -> Dict[str, Dict]:
+        """Найти пользователей по списку тегов: канонический тег -> пользователь"""
+        clean_tags = list({normalize_tag(tag) for tag in royale_tags} - {""})
+        users = {}
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            # Порциями, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(clean_tags), QUERY_CHUNK_SIZE):
+                chunk = clean_tags[start:start + QUERY_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f"SELECT * FROM users WHERE royale_tag_norm IN ({placeholders})", chunk)
+                for row in cursor.fetchall():
+                    users[row["royale_tag_norm"]] = dict(row)
+        return users
+    
+    def find_users_by_nickname(self, royale_nickname: str, limit: int = 10) -> List[Dict]:
+        """Найти пользователей по нику в рояле без учета регистра.
+        
+        Ник не уникален, поэтому возвращается список (не больше limit).
+        Сравнение идет по royale_nickname_norm (casefold, в том числе для кириллицы).
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM users
+                WHERE royale_nickname_norm = ? AND royale_tag IS NOT NULL
+                ORDER BY last_activity DESC
+                LIMIT ?
+            """, (normalize_nickname(royale_nickname), limit))
+            return [dict(row) for row in cursor.fetchall()]
+    
     def get_all_users(self) -> List[Dict]:
         """Получить всех пользователей"""
         with self._get_connection() as conn:
@@ -125,6 +523,51 @@ class Database:
             """)
             return [dict(row) for row in cursor.fetchall()]
     
+    def mark_users_unreachable(self, telegram_ids: Iterable[int]) -> int:
+        """Отметить пользователей, которым бот не может писать; возвращает число новых отметок"""
+        ids = list(telegram_ids)
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                UPDATE users SET unreachable_at = CURRENT_TIMESTAMP
+                WHERE telegram_id = ? AND unreachable_at IS NULL
+            """, [(telegram_id,) for telegram_id in ids])
+            marked = cursor.rowcount
+            conn.commit()
+        if marked:
+            self._invalidate_users(*ids)
+        return marked
+    
+    def set_user_reachable(self, telegram_id: int) -> bool:
+        """Снять отметку недоступности; False, если пользователь не был отмечен"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE users SET unreachable_at = NULL
+                WHERE telegram_id = ? AND unreachable_at IS NOT NULL
+            """, (telegram_id,))
+            changed = cursor.rowcount > 0
+            conn.commit()
+        if changed:
+            self._invalidate_users(telegram_id)
+        return changed
+    
+    def get_unreachable_ids(self, telegram_ids: Iterable[int]) -> Set[int]:
+        """Какие из указанных пользователей отмечены недоступными"""
+        ids = list(set(telegram_ids))
+        unreachable = set()
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+                chunk = ids[start:start + QUERY_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f"""
+                    SELECT telegram_id FROM users
+                    WHERE telegram_id IN ({placeholders}) AND unreachable_at IS NOT NULL
+                """, chunk)
+                unreachable.update(row[0] for row in cursor.fetchall())
+        return unreachable
+    
     def set_user_role(self, telegram_id: int, role: str):
         """Установить роль пользователя"""
         with self._get_connection() as conn:
@@ -133,16 +576,65 @@ class Database:
                 UPDATE users SET role = ? WHERE telegram_id = ?
             """, (role, telegram_id))
             conn.commit()
+        self._invalidate_users(telegram_id)
+    
+    def bulk_set_roles(self, roles: Dict[int, str]) -> List[Dict]:
+        """Установить роли нескольким пользователям одной транзакцией.
+        
+        roles - словарь telegram_id -> роль. Обновляются только строки, где роль
+        действительно изменилась. Возвращает список изменений:
+        {"telegram_id", "royale_nickname", "royale_tag", "old_role", "new_role"}.
+        """
+        if not roles:
+            return []
+        
+        ids = list(roles)
+        changes = []
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            # Блокировка записи сразу: роли не изменятся между чтением и записью
+            cursor.execute("BEGIN IMMEDIATE")
+            for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+                chunk = ids[start:start + QUERY_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f"""
+                    SELECT telegram_id, royale_nickname, royale_tag, role FROM users
+                    WHERE telegram_id IN ({placeholders})
+                """, chunk)
+                for row in cursor.fetchall():
+                    new_role = roles[row["telegram_id"]]
+                    if row["role"] != new_role:
+                        changes.append({
+                            "telegram_id": row["telegram_id"],
+                            "royale_nickname": row["royale_nickname"],
+                            "royale_tag": row["royale_tag"],
+                            "old_role": row["role"],
+                            "new_role": new_role
+                        })
+            
+            cursor.executemany(
+                "UPDATE users SET role = ? WHERE telegram_id = ?",
+                [(change["new_role"], change["telegram_id"]) for change in changes]
+            )
+            conn.commit()
+        if changes:
+            self._invalidate_users(*(change["telegram_id"] for change in changes))
+        return changes
     
     def add_admin(self, telegram_id: int, added_by: int):
         """Добавить админа"""
         with self._get_connection() as conn:
             cursor = conn.cursor()
+            # Не INSERT OR REPLACE: удаление при REPLACE не вызывает триггеры счетчиков
             cursor.execute("""
-                INSERT OR REPLACE INTO admins (telegram_id, added_by)
+                INSERT INTO admins (telegram_id, added_by)
                 VALUES (?, ?)
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    added_by = excluded.added_by,
+                    added_at = CURRENT_TIMESTAMP
             """, (telegram_id, added_by))
             conn.commit()
+        self._invalidate_admins()
     
     def remove_admin(self, telegram_id: int):
         """Удалить админа"""
@@ -150,44 +642,385 @@ class Database:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM admins WHERE telegram_id = ?", (telegram_id,))
             conn.commit()
+        self._invalidate_admins()
     
     def is_admin(self, telegram_id: int) -> bool:
         """Проверить, является ли пользователь админом"""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM admins WHERE telegram_id = ?", (telegram_id,))
-            return cursor.fetchone() is not None
+        return telegram_id in self._admin_ids()
     
     def get_all_admins(self) -> List[int]:
         """Получить список всех админов"""
+        return list(self._admin_ids())
+    
+    def get_admins_with_profiles(self) -> List[Dict]:
+        """Админы вместе с данными пользователя (одним запросом).
+        
+        Для админов, которых нет в таблице users, has_profile = 0, а поля профиля равны None.
+        """
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT telegram_id FROM admins")
-            return [row[0] for row in cursor.fetchall()]
+            cursor.execute("""
+                SELECT a.telegram_id, a.added_by, a.added_at,
+                       u.telegram_id IS NOT NULL AS has_profile,
+                       u.username, u.royale_nickname, u.royale_tag
+                FROM admins a
+                LEFT JOIN users u ON u.telegram_id = a.telegram_id
+                ORDER BY a.added_at
+            """)
+            return [dict(row) for row in cursor.fetchall()]
     
-    def update_war_attacks(self, telegram_id: int, war_date: str, attacks_count: int):
-        """Обновить количество атак в КВ"""
+    def get_counters(self) -> Dict[str, int]:
+        """Счетчики, поддерживаемые триггерами: users_total, users_linked, admins_total"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, value FROM stats_counters")
+            return {row["name"]: row["value"] for row in cursor.fetchall()}
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика бота одним агрегирующим запросом.
+        
+        Общие счетчики берутся из stats_counters, разбивка по ролям и активность -
+        одним проходом по users, участие в войне - по последнему дню в war_attacks.
+        """
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT OR REPLACE INTO war_attacks (telegram_id, war_date, attacks_count, updated_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            """, (telegram_id, war_date, attacks_count))
-            conn.commit()
+                SELECT
+                    (SELECT value FROM stats_counters WHERE name = 'users_total') AS users_total,
+                    (SELECT value FROM stats_counters WHERE name = 'users_linked') AS users_linked,
+                    (SELECT value FROM stats_counters WHERE name = 'admins_total') AS admins_total,
+                    u.active_7d, u.users_unreachable, u.role_leader, u.role_coleader, u.role_elder, u.role_member,
+                    w.war_date, w.war_participants, w.war_attacked, w.war_finished
+                FROM (
+                    SELECT
+                        COALESCE(SUM(last_activity >= datetime('now', '-7 days')), 0) AS active_7d,
+                        COALESCE(SUM(unreachable_at IS NOT NULL), 0) AS users_unreachable,
+                        COALESCE(SUM(role = 'leader'), 0) AS role_leader,
+                        COALESCE(SUM(role = 'coleader'), 0) AS role_coleader,
+                        COALESCE(SUM(role = 'elder'), 0) AS role_elder,
+                        COALESCE(SUM(role = 'member'), 0) AS role_member
+                    FROM users
+                ) u, (
+                    SELECT
+                        lw.war_date,
+                        COUNT(wa.player_tag) AS war_participants,
+                        COALESCE(SUM(wa.battles_played > 0), 0) AS war_attacked,
+                        COALESCE(SUM(wa.battles_remaining = 0), 0) AS war_finished
+                    FROM (SELECT MAX(war_date) AS war_date FROM war_attacks) lw
+                    LEFT JOIN war_attacks wa ON wa.war_date = lw.war_date
+                ) w
+            """)
+            row = cursor.fetchone()
+        
+        stats = dict(row)
+        stats["users_unlinked"] = stats["users_total"] - stats["users_linked"]
+        stats["war_participation"] = (
+            stats["war_attacked"] / stats["war_participants"] if stats["war_participants"] else None
+        )
+        return stats
     
-    def get_users_without_attacks(self, war_date: str) -> List[Dict]:
-        """Получить пользователей, которые не атаковали в КВ"""
+    def update_war_attacks(self, player_tag: str, war_date: str, battles_played: int,
+                           battles_remaining: int):
+        """Обновить количество атак игрока в КВ за день"""
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT u.* FROM users u
-                LEFT JOIN war_attacks wa ON u.telegram_id = wa.telegram_id AND wa.war_date = ?
-                WHERE (wa.attacks_count IS NULL OR wa.attacks_count = 0)
-                AND u.royale_tag IS NOT NULL
+                INSERT INTO war_attacks (player_tag, war_date, battles_played, battles_remaining, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (player_tag, war_date) DO UPDATE SET
+                    battles_played = excluded.battles_played,
+                    battles_remaining = excluded.battles_remaining,
+                    updated_at = excluded.updated_at
+            """, (normalize_tag(player_tag), war_date, battles_played, battles_remaining))
+            conn.commit()
+    
+    def record_war_attacks(self, war_date: str, attacks: Iterable[Tuple[str, int, int]]) -> int:
+        """Записать атаки всех участников войны за день одной транзакцией.
+        
+        attacks - кортежи (тег игрока, battles_played, battles_remaining).
+        Возвращает количество записанных строк.
+        """
+        rows = [
+            (normalize_tag(tag), war_date, played, remaining)
+            for tag, played, remaining in attacks
+        ]
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO war_attacks (player_tag, war_date, battles_played, battles_remaining, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (player_tag, war_date) DO UPDATE SET
+                    battles_played = excluded.battles_played,
+                    battles_remaining = excluded.battles_remaining,
+                    updated_at = excluded.updated_at
+            """, rows)
+            conn.commit()
+        return len(rows)
+    
+    def get_users_without_attacks(self, war_date: str, include_unreachable: bool = False) -> List[Dict]:
+        """Получить пользователей, у которых остались неиспользованные атаки в КВ за день.
+        
+        К данным пользователя добавляются battles_played и battles_remaining.
+        """
+        reachable = "" if include_unreachable else f"AND u.{_REACHABLE}"
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT u.*, wa.battles_played, wa.battles_remaining
+                FROM war_attacks wa
+                JOIN users u ON u.royale_tag_norm = wa.player_tag
+                WHERE wa.war_date = ? AND wa.battles_remaining > 0 {reachable}
             """, (war_date,))
             return [dict(row) for row in cursor.fetchall()]
+    
+    def get_player_war_history(self, player_tag: str, limit: int = 30) -> List[Dict]:
+        """История атак игрока в КВ по дням, сначала последние"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT war_date, battles_played, battles_remaining FROM war_attacks
+                WHERE player_tag = ?
+                ORDER BY war_date DESC
+                LIMIT ?
+            """, (normalize_tag(player_tag), limit))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def get_player_season_stats(self, player_tag: str) -> List[Dict]:
+        """Итоги игрока в КВ по сезонам (для записей старше срока хранения)"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT season, war_days, battles_played, battles_missed FROM war_attacks_season
+                WHERE player_tag = ?
+                ORDER BY season DESC
+            """, (normalize_tag(player_tag),))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def compact_war_attacks(self, retain_days: int) -> int:
+        """Свернуть записи старше retain_days дней в итоги по сезонам (месяцам).
+        
+        Дни с неизвестным battles_remaining (NULL) в пропущенные битвы не входят.
+        Возвращает количество свернутых записей.
+        """
+        cutoff = f"-{retain_days} days"
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                INSERT INTO war_attacks_season (player_tag, season, war_days, battles_played, battles_missed)
+                SELECT player_tag, strftime('%Y-%m', war_date), COUNT(*),
+                       SUM(battles_played), COALESCE(SUM(battles_remaining), 0)
+                FROM war_attacks
+                WHERE war_date < date('now', ?)
+                GROUP BY player_tag, strftime('%Y-%m', war_date)
+                ON CONFLICT (player_tag, season) DO UPDATE SET
+                    war_days = war_days + excluded.war_days,
+                    battles_played = battles_played + excluded.battles_played,
+                    battles_missed = battles_missed + excluded.battles_missed
+            """, (cutoff,))
+            cursor.execute("DELETE FROM war_attacks WHERE war_date < date('now', ?)", (cutoff,))
+            compacted = cursor.rowcount
+            conn.commit()
+        return compacted
+
+    def create_broadcast_job(self, kind: str, payload: Dict, created_by: int,
+                             status_chat_id: int, status_message_id: int,
+                             user_filter: Optional[str] = None,
+                             recipients: Optional[Iterable[Tuple[int, Optional[str]]]] = None) -> int:
+        """Создать задание рассылки вместе со списком получателей.
+        
+        Получатели задаются фильтром пользователей (вставляются одним INSERT ... SELECT,
+        недоступные пользователи пропускаются) или явным списком (telegram_id, extra).
+        Возвращает ID задания.
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO broadcast_jobs (kind, payload, created_by, status_chat_id, status_message_id)
+                VALUES (?, ?, ?, ?, ?)
+            """, (kind, json.dumps(payload, ensure_ascii=False), created_by, status_chat_id, status_message_id))
+            job_id = cursor.lastrowid
+            
+            if user_filter is not None:
+                where = f"{_USER_FILTERS[user_filter]} AND {_REACHABLE}"
+                cursor.execute(f"""
+                    INSERT INTO broadcast_recipients (job_id, telegram_id)
+                    SELECT ?, telegram_id FROM users WHERE {where}
+                """, (job_id,))
+            if recipients is not None:
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO broadcast_recipients (job_id, telegram_id, extra)
+                    VALUES (?, ?, ?)
+                """, [(job_id, telegram_id, extra) for telegram_id, extra in recipients])
+            conn.commit()
+        return job_id
+    
+    def get_broadcast_job(self, job_id: int) -> Optional[Dict]:
+        """Получить задание рассылки"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json_loads(job["payload"])
+        return job
+    
+    def get_next_broadcast_job(self) -> Optional[Dict]:
+        """Самое раннее незавершенное задание (в том числе прерванное перезапуском)"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM broadcast_jobs
+                WHERE status IN ('pending', 'running')
+                ORDER BY id
+                LIMIT 1
+            """)
+            row = cursor.fetchone()
+        return self.get_broadcast_job(row["id"]) if row else None
+    
+    def claim_broadcast_job(self, job_id: int) -> bool:
+        """Перевести задание в running; False, если оно уже завершено или отменено"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE broadcast_jobs SET status = 'running'
+                WHERE id = ? AND status IN ('pending', 'running')
+            """, (job_id,))
+            claimed = cursor.rowcount > 0
+            conn.commit()
+        return claimed
+    
+    def finish_broadcast_job(self, job_id: int, status: str) -> bool:
+        """Завершить задание со статусом done, cancelled или failed.
+        
+        Меняется только незавершенное задание, поэтому отмена не перезаписывается
+        завершением и наоборот. Возвращает False, если задание уже было завершено.
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE broadcast_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('pending', 'running')
+            """, (status, job_id))
+            finished = cursor.rowcount > 0
+            conn.commit()
+        return finished
+    
+    def record_broadcast_job_failure(self, job_id: int, max_attempts: int) -> bool:
+        """Учесть неудачную попытку выполнить задание.
+        
+        После max_attempts попыток задание получает статус failed и больше не
+        выбирается; возвращает True, если это произошло сейчас.
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE broadcast_jobs
+                SET attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END,
+                    finished_at = CASE WHEN attempts + 1 >= ? THEN CURRENT_TIMESTAMP END
+                WHERE id = ? AND status IN ('pending', 'running')
+                RETURNING status
+            """, (max_attempts, max_attempts, job_id))
+            row = cursor.fetchone()
+            conn.commit()
+        return row is not None and row["status"] == "failed"
+    
+    def get_broadcast_recipients_page(self, job_id: int, after_id: int = 0,
+                                      limit: int = 500) -> List[Dict]:
+        """Страница еще не обработанных получателей задания вместе с данными пользователя"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT r.telegram_id, r.extra, u.username, u.royale_nickname
+                FROM broadcast_recipients r
+                LEFT JOIN users u ON u.telegram_id = r.telegram_id
+                WHERE r.job_id = ? AND r.state = 'pending' AND r.telegram_id > ?
+                ORDER BY r.telegram_id
+                LIMIT ?
+            """, (job_id, after_id, limit))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def mark_broadcast_recipient(self, job_id: int, telegram_id: int, state: str):
+        """Записать результат доставки получателю (sent, failed, blocked)"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE broadcast_recipients SET state = ?
+                WHERE job_id = ? AND telegram_id = ?
+            """, (state, job_id, telegram_id))
+            conn.commit()
+    
+    def get_broadcast_progress(self, job_id: int) -> Dict[str, int]:
+        """Количество получателей задания по состояниям доставки"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT state, COUNT(*) AS count FROM broadcast_recipients
+                WHERE job_id = ?
+                GROUP BY state
+            """, (job_id,))
+            return {row["state"]: row["count"] for row in cursor.fetchall()}
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database.
+    
+    Каждый публичный метод Database доступен как корутина с теми же аргументами:
+    
+        user = await async_db.get_user(telegram_id)
+    
+    Запросы выполняются вне event loop: все записи - в одном потоке-писателе
+    (SQLite допускает только одного писателя, так они не конкурируют за блокировку),
+    чтение - в пуле потоков-читателей (в режиме WAL чтение не блокируется записью).
+    """
+    
+    # Методы, изменяющие данные (выполняются в потоке-писателе)
+    WRITE_METHODS = frozenset({
+        "add_user", "update_user_royale_info", "set_user_role", "bulk_set_roles",
+        "add_admin", "remove_admin", "update_war_attacks",
+        "record_war_attacks", "compact_war_attacks", "create_broadcast_job",
+        "claim_broadcast_job", "finish_broadcast_job", "record_broadcast_job_failure",
+        "mark_broadcast_recipient", "mark_users_unreachable",
+        "set_user_reachable"
+    })
+    
+    def __init__(self, database: Database, reader_threads: int = DB_READER_THREADS):
+        self._db = database
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="db-reader")
+    
+    async def run(self, func: Callable, *args, write: bool = True, **kwargs) -> Any:
+        """Выполнить произвольную функцию в потоке писателя или читателя"""
+        executor = self._writer if write else self._readers
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    
+    def __getattr__(self, name: str):
+        method = getattr(self._db, name)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(name)
+        write = name in self.WRITE_METHODS
+        
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, write=write, **kwargs)
+        
+        # Кэшируем обертку, чтобы не создавать ее при каждом обращении
+        setattr(self, name, call)
+        return call
+    
+    def close(self):
+        """Дождаться завершения запросов и остановить потоки"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
 
 
 # Глобальный экземпляр базы данных
 db = Database()
 
+# Асинхронный фасад для использования в обработчиках
+async_db = AsyncDatabase(db)
+
@@ -3,8 +3,12 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import db
+from database import async_db, USER_FILTER_ALL, USER_FILTER_LINKED
 from utils.cr_api import cr_api
+from utils.war_reminders import record_war_attacks, war_date_of
+from utils.broadcast_jobs import (
+    broadcast_worker, JOB_TEXT, JOB_PHOTO, JOB_WAR_REMIND, JOB_INACTIVE_REMIND
+)
 from config import CLAN_TAG
 import logging
 from datetime import datetime
@@ -45,7 +49,7 @@ def get_admin_keyboard() -> InlineKeyboardMarkup:
 @router.message(Command("admin"))
 async def cmd_admin(message: Message):
     """Открыть админ-панель"""
-    if not db.is_admin(message.from_user.id):
+    if not await async_db.is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора.")
         return
     
@@ -103,44 +107,36 @@ async def admin_broadcast_send(callback: CallbackQuery, state: FSMContext):
     """Отправить рассылку"""
     data = await state.get_data()
     text = data.get("broadcast_text", "")
-    send_to_all = callback.data == "broadcast_confirm_all"
-    
-    await callback.message.edit_text("⏳ Отправляю сообщения...")
+    if not text:
+        # Повторное нажатие: рассылка уже поставлена в очередь
+        await callback.answer("ℹ️ Рассылка уже запущена")
+        return
     
-    if send_to_all:
-        users = db.get_all_users()
-    else:
-        users = db.get_users_with_royale_info()
-    
-    sent = 0
-    failed = 0
-    
-    for user in users:
-        try:
-            user_id = user["telegram_id"]
-            mention = f"@{user.get('username', '')}" if user.get("username") else f"<a href='tg://user?id={user_id}'>{user.get('royale_nickname', 'Игрок')}</a>"
-            
-            message_text = f"{mention}\n\n{text}"
-            
-            await callback.bot.send_message(
-                chat_id=user_id,
-                text=message_text,
-                parse_mode="HTML"
-            )
-            sent += 1
-        except Exception as e:
-            logger.error(f"Ошибка при отправке пользователю {user_id}: {e}")
-            failed += 1
+    send_to_all = callback.data == "broadcast_confirm_all"
+    user_filter = USER_FILTER_ALL if send_to_all else USER_FILTER_LINKED
     
-    await callback.message.edit_text(
-        f"✅ Рассылка завершена!\n\n"
-        f"📤 Отправлено: {sent}\n"
-        f"❌ Ошибок: {failed}"
-    )
     await state.clear()
+    # Рассылка выполняется в фоне, прогресс показывается в этом же сообщении
+    await broadcast_worker.enqueue(
+        JOB_TEXT, {"text": text}, callback.from_user.id, callback.message, user_filter=user_filter
+    )
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("broadcast_stop:"))
+async def admin_broadcast_stop(callback: CallbackQuery):
+    """Остановить идущую рассылку"""
+    if not await async_db.is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора.", show_alert=True)
+        return
+    
+    job_id = int(callback.data.split(":", 1)[1])
+    if await broadcast_worker.cancel(job_id):
+        await callback.answer("⛔ Рассылка остановлена")
+    else:
+        await callback.answer("ℹ️ Рассылка уже завершена")
+
+
 @router.callback_query(F.data == "broadcast_cancel")
 async def admin_broadcast_cancel(callback: CallbackQuery, state: FSMContext):
     """Отменить рассылку"""
@@ -205,42 +201,22 @@ async def admin_photo_send(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     file_id = data.get("broadcast_photo")
     caption = data.get("broadcast_caption", "")
-    send_to_all = callback.data == "photo_confirm_all"
-    
-    await callback.message.edit_text("⏳ Отправляю фото...")
+    if not file_id:
+        # Повторное нажатие: рассылка уже поставлена в очередь
+        await callback.answer("ℹ️ Рассылка уже запущена")
+        return
     
-    if send_to_all:
-        users = db.get_all_users()
-    else:
-        users = db.get_users_with_royale_info()
-    
-    sent = 0
-    failed = 0
-    
-    for user in users:
-        try:
-            user_id = user["telegram_id"]
-            mention = f"@{user.get('username', '')}" if user.get("username") else f"<a href='tg://user?id={user_id}'>{user.get('royale_nickname', 'Игрок')}</a>"
-            
-            photo_caption = f"{mention}\n\n{caption}" if caption else mention
-            
-            await callback.bot.send_photo(
-                chat_id=user_id,
-                photo=file_id,
-                caption=photo_caption,
-                parse_mode="HTML"
-            )
-            sent += 1
-        except Exception as e:
-            logger.error(f"Ошибка при отправке фото пользователю {user_id}: {e}")
-            failed += 1
+    send_to_all = callback.data == "photo_confirm_all"
+    user_filter = USER_FILTER_ALL if send_to_all else USER_FILTER_LINKED
     
-    await callback.message.edit_text(
-        f"✅ Рассылка фото завершена!\n\n"
-        f"📤 Отправлено: {sent}\n"
-        f"❌ Ошибок: {failed}"
-    )
     await state.clear()
+    # Предпросмотр - фото, поэтому прогресс показываем в отдельном сообщении
+    await callback.message.edit_reply_markup(reply_markup=None)
+    status_message = await callback.message.answer("⏳ Готовлю рассылку фото...")
+    await broadcast_worker.enqueue(
+        JOB_PHOTO, {"photo": file_id, "caption": caption}, callback.from_user.id, status_message,
+        user_filter=user_filter
+    )
     await callback.answer()
 
 
@@ -253,13 +229,23 @@ async def admin_war_remind(callback: CallbackQuery):
     
     await callback.message.edit_text("⏳ Проверяю статус войны...")
     
-    war_data = await cr_api.get_clan_war(CLAN_TAG)
+    # Только свежие данные: по устаревшему статусу напоминание отправлять нельзя
+    try:
+        war_data = await cr_api.get_clan_war_strict(CLAN_TAG, use_cache=False, allow_stale=False)
+    except Exception as e:
+        logger.error(f"Не удалось получить статус войны для напоминания: {e!r}")
+        await callback.message.edit_text(
+            f"❌ Не удалось получить актуальный статус войны ({cr_api.describe_error(e)}).\n"
+            f"Напоминание не отправлено, попробуйте позже."
+        )
+        await callback.answer()
+        return
     if not war_data:
         await callback.message.edit_text("❌ Нет активной клановой войны.")
         await callback.answer()
         return
     
-    state = war_data.get("state", "")
+    state = war_data.state
     if state == "collectionDay":
         message_text = (
             "📦 <b>Напоминание о клановой войне!</b>\n\n"
@@ -275,26 +261,9 @@ async def admin_war_remind(callback: CallbackQuery):
         await callback.answer()
         return
     
-    users = db.get_users_with_royale_info()
-    sent = 0
-    failed = 0
-    
-    for user in users:
-        try:
-            await callback.bot.send_message(
-                chat_id=user["telegram_id"],
-                text=message_text,
-                parse_mode="HTML"
-            )
-            sent += 1
-        except Exception as e:
-            logger.error(f"Ошибка при отправке напоминания: {e}")
-            failed += 1
-    
-    await callback.message.edit_text(
-        f"✅ Напоминания отправлены!\n\n"
-        f"📤 Отправлено: {sent}\n"
-        f"❌ Ошибок: {failed}"
+    await broadcast_worker.enqueue(
+        JOB_WAR_REMIND, {"text": message_text}, callback.from_user.id, callback.message,
+        user_filter=USER_FILTER_LINKED
     )
     await callback.answer()
 
@@ -308,67 +277,37 @@ async def admin_inactive_remind(callback: CallbackQuery):
     
     await callback.message.edit_text("⏳ Проверяю участников войны...")
     
-    war_data = await cr_api.get_clan_war(CLAN_TAG)
-    if not war_data or war_data.get("state") != "warDay":
+    # Только свежие данные: устаревшие перезаписали бы атаки в базе и число оставшихся атак
+    try:
+        war_data = await cr_api.get_clan_war_strict(CLAN_TAG, use_cache=False, allow_stale=False)
+    except Exception as e:
+        logger.error(f"Не удалось получить данные войны для напоминания неактивным: {e!r}")
+        await callback.message.edit_text(
+            f"❌ Не удалось получить актуальные данные войны ({cr_api.describe_error(e)}).\n"
+            f"Напоминание не отправлено, попробуйте позже."
+        )
+        await callback.answer()
+        return
+    fetched_at = datetime.now()
+    if not war_data or war_data.state != "warDay":
         await callback.message.edit_text("❌ Сейчас не день битвы в клановой войне.")
         await callback.answer()
         return
     
-    # Получаем участников войны
-    participants = war_data.get("clan", {}).get("participants", [])
-    participants_dict = {p.get("tag", "").replace("#", "").upper(): p for p in participants}
-    
-    # Получаем пользователей с указанными тегами
-    users = db.get_users_with_royale_info()
+    # Записываем свежие данные (сборщик мог еще не успеть) и выбираем неактивных из базы
+    war_date = war_date_of(war_data, fetched_at)
+    await record_war_attacks(war_data, fetched_at)
+    users = await async_db.get_users_without_attacks(war_date)
     
-    inactive_users = []
-    for user in users:
-        user_tag = user.get("royale_tag", "").replace("#", "").upper()
-        participant = participants_dict.get(user_tag)
-        
-        if participant:
-            attacks = participant.get("battlesPlayed", 0)
-            max_attacks = participant.get("battlesPlayed", 0) + participant.get("battlesRemaining", 0)
-            
-            if attacks < max_attacks:
-                inactive_users.append((user, attacks, max_attacks))
-    
-    if not inactive_users:
+    if not users:
         await callback.message.edit_text("✅ Все участники выполнили атаки!")
         await callback.answer()
         return
     
-    sent = 0
-    failed = 0
-    
-    for user, attacks, max_attacks in inactive_users:
-        try:
-            user_id = user["telegram_id"]
-            nickname = user.get("royale_nickname", "Игрок")
-            mention = f"@{user.get('username', '')}" if user.get("username") else f"<a href='tg://user?id={user_id}'>{nickname}</a>"
-            
-            remaining = max_attacks - attacks
-            message_text = (
-                f"⚔️ {mention}\n\n"
-                f"Напоминание: у вас осталось <b>{remaining}</b> атак в клановой войне!\n"
-                f"Не забудьте сделать атаки!"
-            )
-            
-            await callback.bot.send_message(
-                chat_id=user_id,
-                text=message_text,
-                parse_mode="HTML"
-            )
-            sent += 1
-        except Exception as e:
-            logger.error(f"Ошибка при отправке напоминания: {e}")
-            failed += 1
-    
-    await callback.message.edit_text(
-        f"✅ Напоминания отправлены неактивным участникам!\n\n"
-        f"👥 Найдено неактивных: {len(inactive_users)}\n"
-        f"📤 Отправлено: {sent}\n"
-        f"❌ Ошибок: {failed}"
+    # Сколько атак осталось - в extra получателя
+    await broadcast_worker.enqueue(
+        JOB_INACTIVE_REMIND, {}, callback.from_user.id, callback.message,
+        recipients=[(user["telegram_id"], str(user["battles_remaining"])) for user in users]
     )
     await callback.answer()
 
@@ -399,13 +338,14 @@ async def cmd_addadmin(message: Message):
     user_id = None
     target_user = None
     username = None
+    user_data = None
     
     # Проверяем, есть ли аргумент (тег)
     parts = message.text.split(maxsplit=1)
     if len(parts) > 1:
         # Пытаемся найти пользователя по тегу
         tag = parts[1].strip()
-        user_data = db.get_user_by_royale_tag(tag)
+        user_data = await async_db.get_user_by_royale_tag(tag)
         
         if not user_data:
             await message.answer(
@@ -417,7 +357,7 @@ async def cmd_addadmin(message: Message):
         
         user_id = user_data["telegram_id"]
         username = user_data.get("royale_nickname", "N/A")
-        
+    
     # Если нет аргумента, проверяем ответ на сообщение
     elif message.reply_to_message:
         target_user = message.reply_to_message.from_user
@@ -431,7 +371,7 @@ async def cmd_addadmin(message: Message):
         username = f"@{target_user.username}" if target_user.username else target_user.first_name
         
         # Добавляем пользователя в базу данных, если его там нет
-        db.add_user(user_id, target_user.username)
+        await async_db.add_user(user_id, target_user.username)
     
     else:
         await message.answer(
@@ -444,7 +384,7 @@ async def cmd_addadmin(message: Message):
         return
     
     # Проверяем, не является ли пользователь уже админом
-    if db.is_admin(user_id):
+    if await async_db.is_admin(user_id):
         await message.answer(
             f"⚠️ Пользователь <b>{username}</b> (ID: {user_id}) уже является администратором.",
             parse_mode="HTML"
@@ -452,7 +392,7 @@ async def cmd_addadmin(message: Message):
         return
     
     # Добавляем пользователя в админы
-    db.add_admin(user_id, message.from_user.id)
+    await async_db.add_admin(user_id, message.from_user.id)
     
     royale_tag = ""
     if user_data:
@@ -467,7 +407,7 @@ async def cmd_addadmin(message: Message):
 @router.message(Command("removeadmin"))
 async def cmd_removeadmin(message: Message):
     """Удалить админа"""
-    if not db.is_admin(message.from_user.id):
+    if not await async_db.is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора.")
         return
     
@@ -478,7 +418,7 @@ async def cmd_removeadmin(message: Message):
     
     try:
         user_id = int(parts[1])
-        db.remove_admin(user_id)
+        await async_db.remove_admin(user_id)
         await message.answer(f"✅ Пользователь {user_id} удален из админов.")
     except ValueError:
         await message.answer("❌ Неверный формат telegram_id.")
@@ -487,20 +427,20 @@ async def cmd_removeadmin(message: Message):
 @router.message(Command("listadmins"))
 async def cmd_listadmins(message: Message):
     """Список админов"""
-    if not db.is_admin(message.from_user.id):
+    if not await async_db.is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора.")
         return
     
-    admins = db.get_all_admins()
+    admins = await async_db.get_admins_with_profiles()
     if not admins:
         await message.answer("📋 Список админов пуст.")
         return
     
     text = "👥 <b>Список админов:</b>\n\n"
-    for admin_id in admins:
-        user = db.get_user(admin_id)
-        if user:
-            text += f"• {user.get('royale_nickname', 'N/A')} (@{user.get('username', 'N/A')}) - {admin_id}\n"
+    for admin in admins:
+        admin_id = admin["telegram_id"]
+        if admin["has_profile"]:
+            text += f"• {admin['royale_nickname'] or 'N/A'} (@{admin['username'] or 'N/A'}) - {admin_id}\n"
         else:
             text += f"• ID: {admin_id}\n"
     
@@ -510,17 +450,29 @@ async def cmd_listadmins(message: Message):
 @router.callback_query(F.data == "admin_stats")
 async def admin_stats(callback: CallbackQuery):
     """Статистика"""
-    total_users = len(db.get_all_users())
-    users_with_nick = len(db.get_users_with_royale_info())
-    admins_count = len(db.get_all_admins())
+    stats = await async_db.get_stats()
     
     text = (
         "📊 <b>Статистика бота:</b>\n\n"
-        f"👥 Всего пользователей: {total_users}\n"
-        f"🎮 С указанным ником: {users_with_nick}\n"
-        f"👑 Админов: {admins_count}"
+        f"👥 Всего пользователей: {stats['users_total']}\n"
+        f"🎮 С указанным ником: {stats['users_linked']}\n"
+        f"❔ Без ника: {stats['users_unlinked']}\n"
+        f"🕒 Активны за 7 дней: {stats['active_7d']}\n"
+        f"🚫 Недоступны для рассылок: {stats['users_unreachable']}\n"
+        f"👑 Админов: {stats['admins_total']}\n\n"
+        "<b>Роли:</b>\n"
+        f"Лидер: {stats['role_leader']}, соруководители: {stats['role_coleader']}, "
+        f"старейшины: {stats['role_elder']}, участники: {stats['role_member']}"
     )
     
+    if stats["war_participation"] is not None:
+        text += (
+            f"\n\n<b>Клановая война ({stats['war_date']}):</b>\n"
+            f"⚔️ Атаковали: {stats['war_attacked']} из {stats['war_participants']} "
+            f"({stats['war_participation']:.0%})\n"
+            f"✅ Использовали все атаки: {stats['war_finished']}"
+        )
+    
     await callback.message.edit_text(text, parse_mode="HTML")
     await callback.answer()
 
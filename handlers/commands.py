@@ -2,9 +2,13 @@ from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
+from database import db
 from utils.cr_api import cr_api
-from utils.royaleapi import royale_api
-from utils.formatters import format_clan_info, format_player_stats, format_clan_members
+from utils.clan_snapshot import clan_snapshot
+from utils.telegram_session import telegram_session
+from utils.player_lookup import lookup_player
+from utils.models import normalize_tag
+from utils.formatters import format_clan_info, format_player_stats, format_clan_members, format_data_as_of
 from config import CLAN_TAG
 
 router = Router()
@@ -94,6 +98,48 @@ async def cmd_config(message: Message):
     config_text += f"🏰 <b>CLAN_TAG:</b> {clan_status}\n"
     config_text += f"   <code>{clan_preview}</code>\n\n"
     
+    # Состояние circuit breaker
+    breaker = cr_api.breaker.status()
+    if breaker["state"] == "closed":
+        breaker_text = "✅ API доступен"
+    elif breaker["state"] == "half_open":
+        breaker_text = "🟡 Проверка доступности API"
+    else:
+        opened_at = breaker["opened_at"]
+        since = f" с {opened_at:%H:%M}" if opened_at else ""
+        breaker_text = (
+            f"🔴 API недоступен{since}, "
+            f"повторная проверка через {breaker['retry_in']:.0f} сек"
+        )
+    config_text += f"🔌 <b>Clash Royale API:</b> {breaker_text}\n"
+    config_text += f"   Ошибок подряд: {breaker['failures']}\n\n"
+    
+    # Статистика кэша API
+    cache_stats = cr_api.cache.stats()
+    config_text += (
+        f"🗄 <b>Кэш API:</b> попаданий {cache_stats['hits']}, "
+        f"промахов {cache_stats['misses']}, записей {cache_stats['size']}\n\n"
+    )
+    
+    # Статистика кэша пользователей в базе
+    user_cache_stats = db.cache_stats()
+    config_text += (
+        f"🗄 <b>Кэш пользователей:</b> попаданий {user_cache_stats['hits']}, "
+        f"промахов {user_cache_stats['misses']}, записей {user_cache_stats['size']}\n\n"
+    )
+    
+    # Очередь исходящих запросов к Telegram по полосам
+    queue_stats = telegram_session.stats()
+    lane_titles = {"interactive": "ответы", "reminders": "напоминания", "broadcasts": "рассылки"}
+    config_text += "📨 <b>Очередь Telegram:</b>\n"
+    for lane, lane_stats in queue_stats["lanes"].items():
+        config_text += (
+            f"   {lane_titles.get(lane, lane)}: в очереди {lane_stats['queued']}, "
+            f"отправлено {lane_stats['sent']}, ожидание {lane_stats['wait_avg'] * 1000:.0f} мс "
+            f"(макс. {lane_stats['wait_max'] * 1000:.0f} мс)\n"
+        )
+    config_text += f"   Flood control: {queue_stats['flood_waits']}\n\n"
+    
     if not CR_API_TOKEN or not CLAN_TAG:
         config_text += "⚠️ <b>Внимание:</b> Для работы бота необходимо установить все параметры в файле .env"
     
@@ -110,11 +156,9 @@ async def cmd_clan(message: Message):
         )
         return
     
-    await message.answer("⏳ Загружаю информацию о клане...")
-    
-    clan_data = await cr_api.get_clan_info(CLAN_TAG)
+    clan_data = await clan_snapshot.get_clan_info()
     if clan_data:
-        text = format_clan_info(clan_data)
+        text = format_clan_info(clan_data) + clan_snapshot.stale_note("clan")
         await message.answer(text, parse_mode="HTML")
     else:
         await message.answer(
@@ -142,11 +186,9 @@ async def cmd_members(message: Message):
         )
         return
     
-    await message.answer("⏳ Загружаю список участников...")
-    
-    members = await cr_api.get_clan_members(CLAN_TAG)
+    members = await clan_snapshot.get_members()
     if members is not None and len(members) > 0:
-        text = format_clan_members(members)
+        text = format_clan_members(members) + clan_snapshot.stale_note("members")
         await message.answer(text, parse_mode="HTML")
     else:
         error_msg = (
@@ -175,19 +217,17 @@ async def cmd_player(message: Message, state: FSMContext):
         )
         return
     
-    player_tag = command_parts[1].replace("#", "")
+    player_tag = normalize_tag(command_parts[1])
     
     await message.answer("⏳ Загружаю статистику игрока...")
     
-    # Пробуем получить данные из официального API
-    player_data = await cr_api.get_player_info(player_tag)
-    
-    # Если не получилось, пробуем RoyaleAPI
-    if not player_data:
-        player_data = await royale_api.get_player_stats(player_tag)
+    # Официальный API с подстраховочным запросом к RoyaleAPI
+    lookup = await lookup_player(player_tag)
     
-    if player_data:
-        text = format_player_stats(player_data)
+    if lookup.player:
+        text = format_player_stats(lookup.player)
+        # Пометка только для последних известных данных официального API
+        text += format_data_as_of(lookup.stale_since)
         await message.answer(text, parse_mode="HTML")
     else:
         await message.answer(
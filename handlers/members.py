@@ -3,7 +3,8 @@ from aiogram.types import Message, ChatMemberUpdated
 from aiogram.filters import ChatMemberUpdatedFilter, KICKED, LEFT, MEMBER, ADMINISTRATOR, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import db
+from database import async_db
+from utils.models import normalize_tag
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,7 +28,7 @@ async def on_new_member(event: ChatMemberUpdated):
         return
     
     # Добавляем пользователя в базу данных
-    db.add_user(user.id, user.username)
+    await async_db.add_user(user.id, user.username)
     
     welcome_text = (
         f"👋 <b>Добро пожаловать, {user.first_name}!</b>\n\n"
@@ -53,7 +54,7 @@ async def on_new_members_group(message: Message):
             continue
         
         # Добавляем пользователя в базу данных
-        db.add_user(user.id, user.username)
+        await async_db.add_user(user.id, user.username)
         
         welcome_text = (
             f"👋 <b>Добро пожаловать, {user.first_name}!</b>\n\n"
@@ -97,7 +98,7 @@ async def process_nickname(message: Message, state: FSMContext):
 @router.message(RoyaleNicknameState.waiting_for_tag)
 async def process_tag(message: Message, state: FSMContext):
     """Обработка тега"""
-    tag = message.text.strip().replace("#", "").upper()
+    tag = normalize_tag(message.text)
     
     if len(tag) < 3:
         await message.answer("❌ Тег слишком короткий. Попробуйте еще раз.")
@@ -107,7 +108,13 @@ async def process_tag(message: Message, state: FSMContext):
     nickname = data.get("nickname")
     
     # Обновляем информацию в базе данных
-    db.update_user_royale_info(message.from_user.id, nickname, tag)
+    if not await async_db.update_user_royale_info(message.from_user.id, nickname, tag):
+        await message.answer(
+            f"❌ Тег <b>#{tag}</b> уже привязан к другому пользователю.\n"
+            f"Проверьте тег и отправьте его еще раз или обратитесь к администратору.",
+            parse_mode="HTML"
+        )
+        return
     
     await message.answer(
         f"✅ Отлично! Ваш ник сохранен:\n"
@@ -1,8 +1,8 @@
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
-from database import db
-from utils.cr_api import cr_api
+from database import async_db
+from utils.clan_snapshot import clan_snapshot
 from config import CLAN_TAG
 import logging
 
@@ -10,11 +10,14 @@ logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Старшинство ролей в клане (для определения повышений и понижений)
+ROLE_RANK = {"member": 0, "elder": 1, "coleader": 2, "leader": 3}
+
 
 @router.message(Command("setrole"))
 async def cmd_setrole(message: Message):
     """Назначить роль на основе ника в рояле"""
-    if not db.is_admin(message.from_user.id):
+    if not await async_db.is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора.")
         return
     
@@ -23,7 +26,7 @@ async def cmd_setrole(message: Message):
     if len(parts) < 3:
         await message.answer(
             "❌ Неверный формат команды.\n"
-            "Использование: /setrole &lt;ник_в_рояле&gt; &lt;роль&gt;\n"
+            "Использование: /setrole &lt;ник_в_рояле или #тег&gt; &lt;роль&gt;\n"
             "Роли: leader, coLeader, elder, member\n\n"
             "Пример: /setrole PlayerName elder",
             parse_mode="HTML"
@@ -37,21 +40,32 @@ async def cmd_setrole(message: Message):
         await message.answer("❌ Неверная роль. Доступные: leader, coLeader, elder, member")
         return
     
-    # Ищем пользователя по нику в рояле
-    users = db.get_users_with_royale_info()
-    found_user = None
-    
-    for user in users:
-        if user.get("royale_nickname", "").lower() == royale_nickname.lower():
-            found_user = user
-            break
+    # Тег (с #) однозначно определяет пользователя, ник - нет
+    if royale_nickname.startswith("#"):
+        found_user = await async_db.get_user_by_royale_tag(royale_nickname)
+        users = [found_user] if found_user else []
+    else:
+        users = await async_db.find_users_by_nickname(royale_nickname)
     
-    if not found_user:
+    if not users:
         await message.answer(f"❌ Пользователь с ником '{royale_nickname}' не найден в базе данных.")
         return
     
+    if len(users) > 1:
+        candidates = "\n".join(
+            f"• {user.get('royale_nickname')} #{user.get('royale_tag')}" for user in users
+        )
+        await message.answer(
+            f"⚠️ Ник '{royale_nickname}' есть у нескольких пользователей:\n\n"
+            f"{candidates}\n\n"
+            f"Укажите тег вместо ника, например: /setrole #{users[0].get('royale_tag')} {role}"
+        )
+        return
+    
+    found_user = users[0]
+    
     # Устанавливаем роль
-    db.set_user_role(found_user["telegram_id"], role)
+    await async_db.set_user_role(found_user["telegram_id"], role)
     
     await message.answer(
         f"✅ Роль установлена!\n\n"
@@ -63,7 +77,7 @@ async def cmd_setrole(message: Message):
 @router.message(Command("syncroles"))
 async def cmd_syncroles(message: Message):
     """Синхронизировать роли с кланом"""
-    if not db.is_admin(message.from_user.id):
+    if not await async_db.is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора.")
         return
     
@@ -71,16 +85,8 @@ async def cmd_syncroles(message: Message):
         await message.answer("❌ Тег клана не настроен.")
         return
     
-    await message.answer("⏳ Синхронизирую роли с кланом...")
-    
-    # Получаем информацию о клане
-    clan_data = await cr_api.get_clan_info(CLAN_TAG)
-    if not clan_data:
-        await message.answer("❌ Не удалось получить информацию о клане.")
-        return
-    
-    # Получаем участников клана
-    members_data = await cr_api.get_clan_members(CLAN_TAG)
+    # Получаем участников клана из снимка (обновляется в фоне)
+    members_data = await clan_snapshot.get_members()
     if not members_data:
         await message.answer("❌ Не удалось получить список участников клана.")
         return
@@ -88,22 +94,37 @@ async def cmd_syncroles(message: Message):
     # Создаем словарь: тег -> роль
     clan_roles = {}
     for member in members_data:
-        tag = member.get("tag", "").replace("#", "").upper()
-        role = member.get("role", "member").lower()
-        clan_roles[tag] = role
-    
-    # Обновляем роли в базе данных
-    users = db.get_users_with_royale_info()
-    updated = 0
-    
-    for user in users:
-        user_tag = user.get("royale_tag", "").replace("#", "").upper()
-        if user_tag in clan_roles:
-            db.set_user_role(user["telegram_id"], clan_roles[user_tag])
-            updated += 1
+        clan_roles[member.key] = member.role.lower()
+    
+    # Пользователи бота из клана (поиск по индексу канонического тега)
+    users = await async_db.get_users_by_royale_tags(clan_roles.keys())
+    
+    # Одна транзакция, записываются только изменившиеся роли
+    changes = await async_db.bulk_set_roles({
+        user["telegram_id"]: clan_roles[user_tag] for user_tag, user in users.items()
+    })
+    
+    promoted = []
+    demoted = []
+    for change in changes:
+        line = (
+            f"• {change['royale_nickname']} #{change['royale_tag']}: "
+            f"{change['old_role']} → {change['new_role']}"
+        )
+        if ROLE_RANK.get(change["new_role"], 0) > ROLE_RANK.get(change["old_role"], 0):
+            promoted.append(line)
+        else:
+            demoted.append(line)
     
-    await message.answer(
+    text = (
         f"✅ Синхронизация завершена!\n\n"
-        f"🔄 Обновлено ролей: {updated}"
+        f"👥 Найдено в клане: {len(users)}\n"
+        f"🔄 Обновлено ролей: {len(changes)}"
     )
+    if promoted:
+        text += "\n\n⬆️ Повышены:\n" + "\n".join(promoted)
+    if demoted:
+        text += "\n\n⬇️ Понижены:\n" + "\n".join(demoted)
+    
+    await message.answer(text)
 
@@ -1,8 +1,9 @@
 from aiogram import Router
 from aiogram.types import Message
 from aiogram.filters import Command
-from utils.cr_api import cr_api
+from utils.clan_snapshot import clan_snapshot
 from utils.formatters import format_war_info, format_player_war_stats
+from utils.models import normalize_tag
 from config import CLAN_TAG
 
 router = Router()
@@ -21,11 +22,9 @@ async def cmd_war(message: Message):
         )
         return
     
-    await message.answer("⏳ Загружаю информацию о войне...")
-    
-    war_data = await cr_api.get_clan_war(CLAN_TAG)
+    war_data = await clan_snapshot.get_war()
     if war_data:
-        text = format_war_info(war_data)
+        text = format_war_info(war_data) + clan_snapshot.stale_note("war")
         await message.answer(text, parse_mode="HTML")
     else:
         await message.answer(
@@ -55,13 +54,11 @@ async def cmd_warstats(message: Message):
         )
         return
     
-    player_tag = command_parts[1].replace("#", "")
-    
-    await message.answer("⏳ Загружаю статистику игрока в войне...")
+    player_tag = normalize_tag(command_parts[1])
     
-    war_data = await cr_api.get_clan_war(CLAN_TAG)
+    war_data = await clan_snapshot.get_war()
     if war_data:
-        text = format_player_war_stats(war_data, player_tag)
+        text = format_player_war_stats(war_data, player_tag) + clan_snapshot.stale_note("war")
         await message.answer(text, parse_mode="HTML")
     else:
         await message.answer(
@@ -85,7 +82,7 @@ async def cmd_remind(message: Message):
     player_tag = None
     
     if len(command_parts) >= 2:
-        player_tag = command_parts[1].replace("#", "")
+        player_tag = normalize_tag(command_parts[1])
     
     war_reminder_service.subscribe(user_id, chat_id, player_tag)
     
@@ -127,7 +124,7 @@ async def cmd_remindnow(message: Message):
     player_tag = None
     
     if len(command_parts) >= 2:
-        player_tag = command_parts[1].replace("#", "")
+        player_tag = normalize_tag(command_parts[1])
     
     error = await war_reminder_service.send_manual_reminder(chat_id, player_tag)
     if error:
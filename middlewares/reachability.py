@@ -0,0 +1,55 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.enums import ChatMemberStatus, ChatType
+from aiogram.types import ChatMemberUpdated, Message, TelegramObject
+from database import async_db
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReachabilityMiddleware(BaseMiddleware):
+    """Отметка недоступности пользователя для рассылок.
+    
+    Пользователь, написавший боту в личку или разблокировавший бота, снова
+    получает рассылки; заблокировавший бота сразу отмечается недоступным.
+    Регистрируется как outer-middleware для message и my_chat_member, поэтому
+    срабатывает и для сообщений, которые не обработал ни один хендлер.
+    """
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            if isinstance(event, Message):
+                await self._on_message(event)
+            elif isinstance(event, ChatMemberUpdated):
+                await self._on_chat_member(event)
+        except Exception as e:
+            # Ошибка отметки не должна мешать обработке самого события
+            logger.error(f"Ошибка при обновлении доступности пользователя: {e}")
+        return await handler(event, data)
+    
+    async def _on_message(self, message: Message):
+        """Сообщение в личке - пользователь снова доступен"""
+        if message.chat.type != ChatType.PRIVATE or not message.from_user:
+            return
+        # Строка пользователя берется из кэша, запись - только если отметка была
+        user = await async_db.get_user(message.from_user.id)
+        if user and user.get("unreachable_at") and await async_db.set_user_reachable(message.from_user.id):
+            logger.info(f"Пользователь {message.from_user.id} снова доступен для рассылок")
+    
+    async def _on_chat_member(self, update: ChatMemberUpdated):
+        """Блокировка или разблокировка бота в личке"""
+        if update.chat.type != ChatType.PRIVATE:
+            return
+        status = update.new_chat_member.status
+        if status == ChatMemberStatus.KICKED:
+            if await async_db.mark_users_unreachable([update.from_user.id]):
+                logger.info(f"Пользователь {update.from_user.id} заблокировал бота")
+        elif status == ChatMemberStatus.MEMBER:
+            if await async_db.set_user_reachable(update.from_user.id):
+                logger.info(f"Пользователь {update.from_user.id} разблокировал бота")
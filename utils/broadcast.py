@@ -0,0 +1,168 @@
+import asyncio
+import random
+import logging
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Optional, Union
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter,
+    TelegramServerError
+)
+from utils.rate_limiter import TokenBucket
+from config import (
+    BROADCAST_RATE, BROADCAST_BURST, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Результат доставки одному получателю
+DELIVERY_SENT = "sent"
+DELIVERY_FAILED = "failed"
+DELIVERY_BLOCKED = "blocked"  # получатель недоступен, пока сам не напишет боту
+
+# Временные ошибки, после которых отправку стоит повторить
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)
+
+# Ответы Bad Request, означающие, что чата с получателем нет
+UNREACHABLE_BAD_REQUESTS = ("chat not found", "user not found", "peer_id_invalid")
+
+
+def is_unreachable_error(error: Exception) -> bool:
+    """Ошибка означает, что писать получателю бесполезно.
+    
+    Forbidden - бот заблокирован, аккаунт удален или пользователь не начинал
+    чат с ботом; "chat not found" - чата с таким ID нет. Повтор не поможет,
+    в отличие от временных ошибок сети и сервера.
+    """
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    if isinstance(error, TelegramBadRequest):
+        message = error.message.lower()
+        return any(text in message for text in UNREACHABLE_BAD_REQUESTS)
+    return False
+
+
+class BroadcastResult:
+    """Итоги рассылки"""
+    
+    __slots__ = ("sent", "failed", "blocked")
+    
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+    
+    @property
+    def processed(self) -> int:
+        """Сколько получателей уже обработано"""
+        return self.sent + self.failed + self.blocked
+
+
+class Broadcaster:
+    """Рассылка сообщений с учетом лимитов Telegram.
+    
+    Сообщения отправляются параллельно (concurrency одновременных отправок),
+    но не чаще rate сообщений в секунду для всех рассылок вместе. Интервал
+    между сообщениями в один чат и общий лимит бота соблюдает сессия
+    (utils.telegram_session). TelegramRetryAfter, дошедший до рассылки,
+    приостанавливает все рассылки на указанное время (не больше max_retries
+    раз на получателя), временные ошибки
+    повторяются с экспоненциальной задержкой, недоступные получатели
+    (см. is_unreachable_error) считаются отдельно и не повторяются.
+    """
+    
+    def __init__(self, rate: float, burst: int, concurrency: int, max_retries: int):
+        # Общий лимит для всех одновременных рассылок
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+    
+    async def run(self, recipients: Union[Iterable[Any], AsyncIterable[Any]],
+                  send: Callable[[Any], Awaitable[Any]],
+                  chat_id: Callable[[Any], int] = lambda user: user["telegram_id"],
+                  on_delivered: Optional[Callable[[Any, str, BroadcastResult], Awaitable[None]]] = None
+                  ) -> BroadcastResult:
+        """Разослать сообщения.
+        
+        recipients - получатели (обычный или асинхронный итератор, читается по мере отправки);
+        send(recipient) - корутина, отправляющая сообщение одному получателю;
+        chat_id(recipient) - ID чата получателя;
+        on_delivered(recipient, outcome, result) - вызывается после каждого обработанного
+        получателя с результатом доставки (DELIVERY_SENT, DELIVERY_FAILED или DELIVERY_BLOCKED).
+        """
+        result = BroadcastResult()
+        # Ограниченная очередь: получатели не читаются сильно раньше отправки
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        
+        async def worker():
+            while True:
+                recipient = await queue.get()
+                try:
+                    outcome = await self._deliver(recipient, send, chat_id(recipient), result)
+                    if on_delivered:
+                        await on_delivered(recipient, outcome, result)
+                except Exception as e:
+                    logger.error(f"Ошибка в обработчике результата рассылки: {e}")
+                finally:
+                    queue.task_done()
+        
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if isinstance(recipients, AsyncIterable):
+                async for recipient in recipients:
+                    await queue.put(recipient)
+            else:
+                for recipient in recipients:
+                    await queue.put(recipient)
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        
+        return result
+    
+    async def _deliver(self, recipient: Any, send: Callable[[Any], Awaitable[Any]],
+                       chat: int, result: BroadcastResult) -> str:
+        """Отправить сообщение одному получателю с повторами; возвращает результат доставки"""
+        attempt = 0
+        flood_attempts = 0
+        while True:
+            await self.rate_limiter.acquire()
+            try:
+                await send(recipient)
+                result.sent += 1
+                return DELIVERY_SENT
+            except TelegramRetryAfter as e:
+                # Flood control касается всего бота: притормаживаем все отправки
+                logger.warning(f"Flood control при рассылке, пауза {e.retry_after} сек")
+                self.rate_limiter.pause(e.retry_after)
+                # Чат, который снова и снова упирается в flood control, не держит обработчик бесконечно
+                if flood_attempts >= self.max_retries:
+                    logger.error(f"Не удалось отправить сообщение в чат {chat}: flood control после {flood_attempts} повторов")
+                    result.failed += 1
+                    return DELIVERY_FAILED
+                flood_attempts += 1
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"Не удалось отправить сообщение в чат {chat}: {e}")
+                    result.failed += 1
+                    return DELIVERY_FAILED
+                attempt += 1
+                delay = min(2 ** attempt, 30) * (0.5 + random.random() / 2)
+                logger.warning(f"Временная ошибка при отправке в чат {chat}: {e}. Повтор через {delay:.1f} сек")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                if is_unreachable_error(e):
+                    logger.debug(f"Чат {chat} недоступен: {e}")
+                    result.blocked += 1
+                    return DELIVERY_BLOCKED
+                logger.error(f"Ошибка при отправке в чат {chat}: {e}")
+                result.failed += 1
+                return DELIVERY_FAILED
+
+
+broadcaster = Broadcaster(
+    rate=BROADCAST_RATE,
+    burst=BROADCAST_BURST,
+    concurrency=BROADCAST_CONCURRENCY,
+    max_retries=BROADCAST_MAX_RETRIES
+)
@@ -0,0 +1,283 @@
+import asyncio
+import time
+import logging
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+from aiogram import Bot
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+from database import async_db
+from utils.broadcast import broadcaster, BroadcastResult, DELIVERY_BLOCKED
+from utils.rate_limiter import request_priority, PRIORITY_BROADCAST
+from config import BROADCAST_PROGRESS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Виды рассылок
+JOB_TEXT = "text"  # текст админа с упоминанием получателя
+JOB_PHOTO = "photo"  # фото с подписью и упоминанием получателя
+JOB_WAR_REMIND = "war_remind"  # одинаковый текст всем
+JOB_INACTIVE_REMIND = "inactive_remind"  # в extra получателя - сколько атак осталось
+
+# Статусы заданий
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+
+# Сколько получателей читать из базы за один запрос
+RECIPIENTS_PAGE_SIZE = 500
+
+# После стольких неудачных попыток задание помечается failed и больше не выбирается
+JOB_MAX_ATTEMPTS = 3
+
+
+def user_mention(user: Dict) -> str:
+    """Упоминание пользователя для рассылки: @username или ссылка с ником"""
+    if user.get("username"):
+        return f"@{user['username']}"
+    return f"<a href='tg://user?id={user['telegram_id']}'>{user.get('royale_nickname') or 'Игрок'}</a>"
+
+
+def format_broadcast_status(title: str, progress: Dict[str, int]) -> str:
+    """Текст статуса рассылки по количеству получателей в каждом состоянии"""
+    total = sum(progress.values())
+    processed = total - progress.get("pending", 0)
+    return (
+        f"{title}\n\n"
+        f"📊 Обработано: {processed} из {total}\n"
+        f"📤 Отправлено: {progress.get('sent', 0)}\n"
+        f"🚫 Недоступны (заблокировали бота): {progress.get('blocked', 0)}\n"
+        f"❌ Ошибок: {progress.get('failed', 0)}"
+    )
+
+
+def get_cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Кнопка остановки рассылки"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⛔ Остановить рассылку", callback_data=f"broadcast_stop:{job_id}")]
+    ])
+
+
+class BroadcastJobWorker:
+    """Фоновое выполнение рассылок, сохраненных в базе.
+    
+    Задание и состояние доставки каждому получателю хранятся в SQLite, поэтому
+    после перезапуска бота прерванная рассылка продолжается с тех, кому
+    сообщение еще не отправлено. Задания выполняются по очереди; прогресс
+    показывается редактированием сообщения админа не чаще раза в
+    BROADCAST_PROGRESS_INTERVAL секунд.
+    """
+    
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._current_job_id: Optional[int] = None
+        self._current_run: Optional[asyncio.Task] = None
+    
+    def start(self, bot: Bot):
+        """Запустить обработку заданий (незавершенные задания продолжаются)"""
+        if self._task is not None:
+            return
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+        logger.info("Обработчик рассылок запущен")
+    
+    async def stop(self):
+        """Остановить обработку; текущее задание продолжится после перезапуска"""
+        if self._task is None:
+            return
+        tasks = [task for task in (self._task, self._current_run) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._current_run = None
+        logger.info("Обработчик рассылок остановлен")
+    
+    async def enqueue(self, kind: str, payload: Dict, created_by: int, status_message: Message,
+                      user_filter: Optional[str] = None,
+                      recipients: Optional[Iterable[Tuple[int, Optional[str]]]] = None) -> int:
+        """Поставить рассылку в очередь.
+        
+        status_message - текстовое сообщение бота, в котором будет показываться прогресс.
+        """
+        job_id = await async_db.create_broadcast_job(
+            kind, payload, created_by, status_message.chat.id, status_message.message_id,
+            user_filter=user_filter, recipients=recipients
+        )
+        progress = await async_db.get_broadcast_progress(job_id)
+        await status_message.edit_text(
+            format_broadcast_status("⏳ Рассылка поставлена в очередь", progress),
+            reply_markup=get_cancel_keyboard(job_id)
+        )
+        self._wakeup.set()
+        return job_id
+    
+    async def cancel(self, job_id: int) -> bool:
+        """Остановить рассылку; False, если она уже завершена"""
+        # Отмена сохраняется в базе до остановки отправки: после перезапуска
+        # задание не будет выбрано снова
+        if not await async_db.finish_broadcast_job(job_id, JOB_CANCELLED):
+            return False
+        
+        if self._current_job_id == job_id and self._current_run is not None:
+            # Итоговое сообщение покажет _run_job после остановки отправки
+            self._current_run.cancel()
+        else:
+            await self._finish_status(await async_db.get_broadcast_job(job_id), "❌ Рассылка отменена")
+        return True
+    
+    async def _run(self):
+        """Выполнять задания по очереди"""
+        # Запросы рассылок - в самой низкой полосе очереди Telegram
+        with request_priority(PRIORITY_BROADCAST):
+            await self._loop()
+    
+    async def _loop(self):
+        """Брать из базы незавершенные задания и выполнять их"""
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await async_db.get_next_broadcast_job()
+            except Exception as e:
+                logger.error(f"Ошибка при чтении заданий рассылки: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=60)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run_job(job)
+            except Exception:
+                # Ошибка базы при сохранении итога не должна останавливать обработчик
+                logger.exception(f"Ошибка обработчика рассылки {job['id']}")
+                await asyncio.sleep(10)
+    
+    async def _run_job(self, job: Dict):
+        """Выполнить одно задание и показать итог"""
+        self._current_job_id = job["id"]
+        self._current_run = asyncio.create_task(self._process(job))
+        try:
+            # asyncio.wait не отменяет задание при остановке самого обработчика
+            await asyncio.wait({self._current_run})
+        finally:
+            run, self._current_run, self._current_job_id = self._current_run, None, None
+        
+        if run.cancelled():
+            # Остановка всего обработчика сюда не доходит, поэтому это отмена рассылки
+            await async_db.finish_broadcast_job(job["id"], JOB_CANCELLED)
+            await self._finish_status(job, "❌ Рассылка отменена")
+            return
+        if run.exception() is not None:
+            logger.error(f"Ошибка при выполнении рассылки {job['id']}: {run.exception()}")
+            if await async_db.record_broadcast_job_failure(job["id"], JOB_MAX_ATTEMPTS):
+                logger.error(f"Рассылка {job['id']} остановлена после {JOB_MAX_ATTEMPTS} неудачных попыток")
+                await self._finish_status(job, "⚠️ Рассылка остановлена из-за ошибок")
+            else:
+                # Задание будет повторено для оставшихся получателей
+                await asyncio.sleep(10)
+            return
+        if run.result() is None:
+            # Задание отменили до начала отправки
+            return
+        
+        if await async_db.finish_broadcast_job(job["id"], JOB_DONE):
+            await self._finish_status(job, "✅ Рассылка завершена!")
+        else:
+            # Отмену нажали, когда отправка уже закончилась
+            await self._finish_status(job, "❌ Рассылка отменена")
+    
+    async def _process(self, job: Dict) -> Optional[BroadcastResult]:
+        """Разослать сообщения оставшимся получателям задания; None, если задание уже отменено"""
+        job_id = job["id"]
+        if not await async_db.claim_broadcast_job(job_id):
+            return None
+        if job["status"] == JOB_RUNNING:
+            logger.info(f"Продолжаю прерванную рассылку {job_id}")
+        
+        send = self._make_sender(job)
+        last_progress_at = time.monotonic()
+        
+        async def on_delivered(recipient: Dict, outcome: str, result: BroadcastResult):
+            nonlocal last_progress_at
+            await async_db.mark_broadcast_recipient(job_id, recipient["telegram_id"], outcome)
+            if outcome == DELIVERY_BLOCKED:
+                # Следующие рассылки пропустят пользователя, пока он снова не напишет боту
+                await async_db.mark_users_unreachable([recipient["telegram_id"]])
+            if time.monotonic() - last_progress_at >= BROADCAST_PROGRESS_INTERVAL:
+                last_progress_at = time.monotonic()
+                progress = await async_db.get_broadcast_progress(job_id)
+                await self._edit_status(
+                    job["status_chat_id"], job["status_message_id"],
+                    format_broadcast_status("⏳ Идет рассылка...", progress),
+                    get_cancel_keyboard(job_id)
+                )
+        
+        return await broadcaster.run(self._pending_recipients(job_id), send, on_delivered=on_delivered)
+    
+    async def _pending_recipients(self, job_id: int) -> AsyncIterator[Dict]:
+        """Получатели, которым сообщение еще не отправлялось (порциями по первичному ключу)"""
+        after_id = 0
+        while True:
+            page = await async_db.get_broadcast_recipients_page(job_id, after_id, RECIPIENTS_PAGE_SIZE)
+            for recipient in page:
+                yield recipient
+            if len(page) < RECIPIENTS_PAGE_SIZE:
+                return
+            after_id = page[-1]["telegram_id"]
+    
+    def _make_sender(self, job: Dict):
+        """Функция отправки сообщения одному получателю для вида задания"""
+        kind = job["kind"]
+        payload = job["payload"]
+        bot = self.bot
+        
+        async def send(recipient: Dict):
+            chat_id = recipient["telegram_id"]
+            if kind == JOB_TEXT:
+                await bot.send_message(chat_id, f"{user_mention(recipient)}\n\n{payload['text']}", parse_mode="HTML")
+            elif kind == JOB_PHOTO:
+                mention = user_mention(recipient)
+                caption = payload.get("caption")
+                await bot.send_photo(
+                    chat_id, photo=payload["photo"],
+                    caption=f"{mention}\n\n{caption}" if caption else mention,
+                    parse_mode="HTML"
+                )
+            elif kind == JOB_WAR_REMIND:
+                await bot.send_message(chat_id, payload["text"], parse_mode="HTML")
+            elif kind == JOB_INACTIVE_REMIND:
+                text = (
+                    f"⚔️ {user_mention(recipient)}\n\n"
+                    f"Напоминание: у вас осталось <b>{recipient['extra']}</b> атак в клановой войне!\n"
+                    f"Не забудьте сделать атаки!"
+                )
+                await bot.send_message(chat_id, text, parse_mode="HTML")
+            else:
+                raise ValueError(f"Неизвестный вид рассылки: {kind}")
+        
+        return send
+    
+    async def _finish_status(self, job: Dict, title: str):
+        """Показать итог рассылки в сообщении админа"""
+        progress = await async_db.get_broadcast_progress(job["id"])
+        await self._edit_status(job["status_chat_id"], job["status_message_id"],
+                                format_broadcast_status(title, progress))
+    
+    async def _edit_status(self, chat_id: int, message_id: int, text: str,
+                           reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Обновить сообщение со статусом; ошибки (сообщение удалено, не изменилось) не важны"""
+        if self.bot is None or not chat_id or not message_id:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+            )
+        except Exception as e:
+            logger.debug(f"Не удалось обновить статус рассылки: {e}")
+
+
+broadcast_worker = BroadcastJobWorker()
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Кэш в памяти с временем жизни записей и вытеснением по LRU.
+    
+    Устаревшие записи не удаляются сразу: они доступны через get_stale()
+    как последние известные данные, пока их не вытеснит LRU.
+    """
+    
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Tuple[float, datetime, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Получить значение, если оно есть и не устарело"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self.misses += 1
+            return None
+        
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """Сохранить значение на ttl секунд"""
+        self._data[key] = (time.monotonic() + ttl, datetime.now(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+    
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """Получить значение, даже если оно устарело"""
+        entry = self._data.get(key)
+        return entry[2] if entry else None
+    
+    def stored_at(self, key: Hashable) -> Optional[datetime]:
+        """Когда значение было сохранено"""
+        entry = self._data.get(key)
+        return entry[1] if entry else None
+    
+    def invalidate(self, key: Hashable):
+        """Удалить значение из кэша"""
+        self._data.pop(key, None)
+    
+    def clear(self):
+        """Очистить кэш"""
+        self._data.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data)
+        }
@@ -0,0 +1,99 @@
+import time
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Запрос отклонен: circuit breaker открыт"""
+    
+    def __init__(self, retry_in: float):
+        super().__init__(f"API временно недоступен, повтор через {retry_in:.0f} сек")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Circuit breaker для внешнего API.
+    
+    closed - запросы идут как обычно, считаются ошибки подряд;
+    open - после failure_threshold ошибок подряд запросы сразу отклоняются
+           в течение reset_timeout секунд;
+    half_open - после паузы пропускается один пробный запрос: успех закрывает
+                breaker, ошибка снова открывает его.
+    """
+    
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._opened_at_wall: Optional[datetime] = None
+        self._probe_in_flight = False
+    
+    @property
+    def is_closed(self) -> bool:
+        return self.state == STATE_CLOSED
+    
+    def retry_in(self) -> float:
+        """Сколько секунд осталось до пробного запроса"""
+        if self.state != STATE_OPEN:
+            return 0.0
+        return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+    
+    def allow_request(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == STATE_CLOSED:
+            return True
+        
+        if self.state == STATE_OPEN:
+            if self.retry_in() > 0:
+                return False
+            self.state = STATE_HALF_OPEN
+            logger.info(f"Circuit breaker {self.name}: пробный запрос")
+        
+        # half_open: одновременно пропускаем только один пробный запрос
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+    
+    def record_success(self):
+        """Учесть успешный запрос"""
+        self._probe_in_flight = False
+        self.failures = 0
+        if self.state != STATE_CLOSED:
+            self.state = STATE_CLOSED
+            self._opened_at_wall = None
+            logger.info(f"Circuit breaker {self.name} закрыт, API снова доступен")
+    
+    def record_failure(self):
+        """Учесть неудачный запрос"""
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != STATE_OPEN:
+                logger.warning(
+                    f"Circuit breaker {self.name} открыт после {self.failures} ошибок подряд, "
+                    f"пауза {self.reset_timeout:.0f} сек"
+                )
+            self.state = STATE_OPEN
+            self._opened_at = time.monotonic()
+            if self._opened_at_wall is None:
+                self._opened_at_wall = datetime.now()
+    
+    def status(self) -> Dict:
+        """Текущее состояние (для /config)"""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened_at": self._opened_at_wall,
+            "retry_in": self.retry_in()
+        }
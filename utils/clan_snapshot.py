@@ -0,0 +1,159 @@
+import asyncio
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from utils.models import Clan, Member, War
+from utils.cr_api import cr_api
+from utils.formatters import format_data_as_of
+from utils.rate_limiter import request_priority, PRIORITY_BACKGROUND
+from config import (
+    CLAN_TAG, SNAPSHOT_INTERVAL_WAR, SNAPSHOT_INTERVAL_COLLECTION,
+    SNAPSHOT_INTERVAL_IDLE, SNAPSHOT_MAX_AGE
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotEntry:
+    """Часть снимка клана и время ее получения из API"""
+    
+    __slots__ = ("data", "updated_at", "fetched_at")
+    
+    def __init__(self, data: Any, fetched_at: Optional[datetime] = None):
+        self.data = data
+        # Данные могли прийти из кэша cr_api - тогда они старше момента обновления снимка
+        now = datetime.now()
+        self.fetched_at = min(fetched_at, now) if fetched_at else now
+        self.updated_at = time.monotonic() - (now - self.fetched_at).total_seconds()
+    
+    @property
+    def age(self) -> float:
+        """Возраст данных в секундах"""
+        return time.monotonic() - self.updated_at
+
+
+class ClanSnapshotService:
+    """Фоновое обновление снимка клана (информация, участники, текущая война).
+    
+    Команды читают данные из снимка без ожидания API. Обновление блокирует
+    команду, только если данных еще нет или они старше SNAPSHOT_MAX_AGE.
+    Если обновление не удалось, продолжают отдаваться последние данные.
+    """
+    
+    def __init__(self, clan_tag: str):
+        self.clan_tag = clan_tag
+        self._entries: Dict[str, SnapshotEntry] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+        self._failures = 0
+    
+    def start(self):
+        """Запустить фоновое обновление"""
+        if not self.clan_tag or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info("Сервис снимка клана запущен")
+    
+    async def stop(self):
+        """Остановить фоновое обновление"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Сервис снимка клана остановлен")
+    
+    async def _run(self):
+        """Цикл фонового обновления с адаптивным интервалом"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении снимка клана: {e}")
+            await asyncio.sleep(self._next_interval())
+    
+    def _next_interval(self) -> float:
+        """Интервал до следующего обновления в зависимости от фазы войны"""
+        war = self._data("war")
+        state = war.state if war else None
+        if state == "warDay":
+            interval = SNAPSHOT_INTERVAL_WAR
+        elif state == "collectionDay":
+            interval = SNAPSHOT_INTERVAL_COLLECTION
+        else:
+            interval = SNAPSHOT_INTERVAL_IDLE
+        
+        # При ошибках увеличиваем интервал, чтобы не нагружать недоступный API
+        if self._failures:
+            interval = min(interval * (2 ** min(self._failures, 5)), SNAPSHOT_INTERVAL_IDLE)
+        return interval
+    
+    async def refresh(self):
+        """Обновить снимок (одновременные вызовы объединяются в одно обновление)"""
+        if self._refresh_lock.locked():
+            # Обновление уже идет - просто дожидаемся его
+            async with self._refresh_lock:
+                return
+        
+        async with self._refresh_lock:
+            with request_priority(PRIORITY_BACKGROUND):
+                # allow_stale=False: устаревшие данные из кэша не должны выглядеть свежими
+                clan, members, war = await asyncio.gather(
+                    cr_api.get_clan_info(self.clan_tag, allow_stale=False),
+                    cr_api.get_clan_members(self.clan_tag, allow_stale=False),
+                    cr_api.get_clan_war(self.clan_tag, allow_stale=False)
+                )
+            
+            failed = False
+            for name, data in (("clan", clan), ("members", members), ("war", war)):
+                if data is None:
+                    failed = True
+                else:
+                    self._entries[name] = SnapshotEntry(data, cr_api.cached_at(name, self.clan_tag))
+            self._failures = self._failures + 1 if failed else 0
+    
+    def _data(self, name: str) -> Any:
+        """Данные части снимка без обновления"""
+        entry = self._entries.get(name)
+        return entry.data if entry else None
+    
+    async def _get(self, name: str) -> Any:
+        """Данные части снимка; обновляет снимок, только если он слишком старый"""
+        entry = self._entries.get(name)
+        if entry is None or entry.age > SNAPSHOT_MAX_AGE:
+            await self.refresh()
+            entry = self._entries.get(name)
+        return entry.data if entry else None
+    
+    async def get_clan_info(self) -> Optional[Clan]:
+        """Информация о клане"""
+        return await self._get("clan")
+    
+    async def get_members(self) -> Optional[List[Member]]:
+        """Участники клана"""
+        return await self._get("members")
+    
+    async def get_war(self) -> Optional[War]:
+        """Текущая клановая война"""
+        return await self._get("war")
+    
+    def fetched_at(self, name: str) -> Optional[datetime]:
+        """Время получения части снимка ("clan", "members" или "war")"""
+        entry = self._entries.get(name)
+        return entry.fetched_at if entry else None
+    
+    def stale_note(self, name: str) -> str:
+        """Пометка "данные на ЧЧ:ММ", если API недоступен или снимок давно не обновлялся"""
+        entry = self._entries.get(name)
+        if entry is None:
+            return ""
+        if cr_api.breaker.is_closed and entry.age <= SNAPSHOT_INTERVAL_IDLE * 2:
+            return ""
+        return format_data_as_of(entry.fetched_at)
+
+
+clan_snapshot = ClanSnapshotService(CLAN_TAG)
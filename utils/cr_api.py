@@ -1,6 +1,54 @@
+import asyncio
+import random
+import traceback
 import aiohttp
-from typing import Optional, Dict, List
-from config import CR_API_TOKEN, CR_API_BASE_URL
+from datetime import datetime
+from typing import (
+    Optional, Dict, List, Any, AsyncIterator, Awaitable, Callable, Hashable,
+    Iterable, NamedTuple, Tuple
+)
+from config import (
+    CR_API_TOKEN, CR_API_BASE_URL, CR_CACHE_MAX_ENTRIES,
+    CR_CACHE_TTL_CLAN, CR_CACHE_TTL_MEMBERS, CR_CACHE_TTL_WAR,
+    CR_CACHE_TTL_PLAYER, CR_CACHE_TTL_BATTLELOG,
+    CR_API_RATE_LIMIT, CR_API_BURST, CR_API_MAX_RETRIES,
+    CR_API_RETRY_BASE_DELAY, CR_API_RETRY_MAX_DELAY, CR_API_BULK_CONCURRENCY,
+    CR_BREAKER_FAILURE_THRESHOLD, CR_BREAKER_RESET_TIMEOUT
+)
+from utils.http import create_session
+from utils.cache import TTLCache
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.json_codec import json_loads
+from utils.models import Clan, Member, Player, War, normalize_tag
+from utils.rate_limiter import TokenBucket, current_priority, request_priority, PRIORITY_BACKGROUND
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Статусы, которые считаются отказом API для circuit breaker
+# (403 - токен отозван или IP не в белом списке)
+BREAKER_FAILURE_STATUSES = {403, 429, 500, 502, 503, 504}
+
+
+class CRAPIError(Exception):
+    """Ошибка ответа Clash Royale API (статус, отличный от 200)"""
+    
+    def __init__(self, status: int, url: str, text: str = ""):
+        super().__init__(f"Clash Royale API вернул статус {status} для {url}")
+        self.status = status
+        self.url = url
+        self.text = text
+
+
+class BulkResult(NamedTuple):
+    """Результат запроса по одному тегу в массовой выборке"""
+    tag: str
+    data: Any
+    error: Optional[str]
+    
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 
 class ClashRoyaleAPI:
@@ -14,100 +62,332 @@ class ClashRoyaleAPI:
             "Authorization": f"Bearer {CR_API_TOKEN}",
             "Accept": "application/json"
         }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.cache = TTLCache(CR_CACHE_MAX_ENTRIES)
+        # URL -> задача выполняющегося запроса (для объединения одинаковых запросов)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.rate_limiter = TokenBucket(CR_API_RATE_LIMIT, CR_API_BURST)
+        self.breaker = CircuitBreaker("Clash Royale API", CR_BREAKER_FAILURE_THRESHOLD, CR_BREAKER_RESET_TIMEOUT)
     
-    async def get_clan_info(self, clan_tag: str) -> Optional[Dict]:
-        """Получить информацию о клане"""
+    async def start(self):
+        """Открыть общую HTTP-сессию (вызывается при запуске бота)"""
+        if self._session is None or self._session.closed:
+            self._session = create_session(self.headers)
+    
+    async def close(self):
+        """Закрыть общую HTTP-сессию (вызывается при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получить общую сессию, открыв ее при необходимости"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    async def _request(self, url: str) -> Tuple[int, Any]:
+        """Выполнить GET-запрос, объединяя одновременные запросы к одному URL.
+        
+        Возвращает (статус, разобранный JSON) при успехе или (статус, текст ответа) при ошибке.
+        Если такой же запрос уже выполняется, вызывающий ждет его результат
+        вместо отправки нового HTTP-запроса. Пока circuit breaker открыт,
+        выбрасывается CircuitOpenError без обращения к API.
+        """
+        task = self._inflight.get(url)
+        if task is None:
+            if not self.breaker.allow_request():
+                raise CircuitOpenError(self.breaker.retry_in())
+            task = asyncio.ensure_future(self._send_guarded(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda t: self._request_done(url, t))
+        # shield: отмена одного из ожидающих не отменяет общий запрос
+        return await asyncio.shield(task)
+    
+    def _request_done(self, url: str, task: asyncio.Task):
+        """Убрать завершенный запрос из таблицы выполняющихся"""
+        if self._inflight.get(url) is task:
+            del self._inflight[url]
+        if not task.cancelled():
+            # Помечаем исключение как полученное, даже если все ожидающие отменены
+            task.exception()
+    
+    async def _send_guarded(self, url: str) -> Tuple[int, Any]:
+        """Отправить запрос и сообщить результат circuit breaker"""
         try:
-            clean_tag = clan_tag.replace('#', '').upper()
-            url = f"{self.base_url}/clans/%23{clean_tag}"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
+            status, data = await self._send_request(url)
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        
+        if status in BREAKER_FAILURE_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return status, data
+    
+    async def _send_request(self, url: str) -> Tuple[int, Any]:
+        """Отправить HTTP-запрос через общую сессию с учетом лимита и повторов.
+        
+        Перед каждой попыткой берется токен из ограничителя (с приоритетом
+        текущего контекста). При 429/5xx и сетевых ошибках запрос повторяется
+        с экспоненциальной задержкой и джиттером; для 429 учитывается Retry-After.
+        """
+        session = await self._get_session()
+        for attempt in range(CR_API_MAX_RETRIES + 1):
+            await self.rate_limiter.acquire(current_priority())
+            try:
+                async with session.get(url) as response:
                     if response.status == 200:
-                        return await response.json()
-                    else:
-                        error_text = await response.text()
-                        print(f"Ошибка API при получении информации о клане: статус {response.status}")
-                        print(f"URL: {url}")
-                        print(f"Ответ: {error_text[:200]}")
-                        return None
-        except aiohttp.ClientError as e:
-            print(f"Ошибка сети при получении информации о клане: {e}")
+                        return response.status, json_loads(await response.read())
+                    
+                    status = response.status
+                    text = await response.text()
+                    retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == CR_API_MAX_RETRIES:
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"Ошибка сети при запросе {url}: {e}. Повтор через {delay:.1f} сек")
+                await asyncio.sleep(delay)
+                continue
+            
+            if status not in RETRY_STATUSES or attempt == CR_API_MAX_RETRIES:
+                return status, text
+            
+            delay = self._backoff_delay(attempt, retry_after)
+            if status == 429:
+                # Лимит исчерпан для всего ключа, поэтому притормаживаем все запросы
+                self.rate_limiter.pause(delay)
+            print(f"API вернул статус {status} для {url}. Повтор через {delay:.1f} сек")
+            await asyncio.sleep(delay)
+        
+        return status, text
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Разобрать заголовок Retry-After (в секундах)"""
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
             return None
+    
+    @staticmethod
+    def _backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+        """Задержка перед повтором: Retry-After или экспонента, плюс джиттер"""
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = CR_API_RETRY_BASE_DELAY * (2 ** attempt)
+        delay = min(delay, CR_API_RETRY_MAX_DELAY)
+        return delay + random.uniform(0, delay * 0.25)
+    
+    async def _cached(self, key: Hashable, ttl: float, use_cache: bool,
+                      fetch: Callable[[], Awaitable[Any]], allow_stale: bool = True) -> Any:
+        """Вернуть значение из кэша или запросить его и сохранить.
+        
+        При use_cache=False кэш не читается, но свежий ответ в него записывается.
+        Неудачные ответы (None) не кэшируются. Если запрос не удался
+        (кроме 404) и allow_stale=True, возвращаются последние известные данные.
+        """
+        if use_cache:
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+        
+        try:
+            value = await fetch()
         except Exception as e:
-            print(f"Неожиданная ошибка при получении информации о клане: {e}")
+            if isinstance(e, CRAPIError) and e.status == 404:
+                raise
+            stale = self.cache.get_stale(key) if allow_stale else None
+            if stale is None:
+                raise
+            print(f"Используются последние известные данные для {key}: {e}")
+            return stale
+        
+        if value is not None:
+            self.cache.set(key, value, ttl)
+        return value
+    
+    async def _get_json(self, url: str) -> Any:
+        """Выполнить запрос и вернуть JSON или выбросить CRAPIError"""
+        status, data = await self._request(url)
+        if status != 200:
+            raise CRAPIError(status, url, data)
+        return data
+    
+    @staticmethod
+    def describe_error(error: Exception) -> str:
+        """Краткое описание ошибки запроса для пользователя"""
+        if isinstance(error, CRAPIError):
+            return f"API вернул ошибку {error.status}"
+        if isinstance(error, CircuitOpenError):
+            return "API временно недоступен"
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return "ошибка сети"
+        return "неизвестная ошибка"
+    
+    @staticmethod
+    def _report_error(action: str, clean_tag: str, error: Exception):
+        """Вывести описание ошибки запроса"""
+        if isinstance(error, CRAPIError):
+            print(f"Ошибка API при получении {action}: статус {error.status}")
+            print(f"URL: {error.url}")
+            print(f"Ответ: {error.text[:200]}")
+            if error.status == 403:
+                print("Ошибка 403: Проверьте API токен и его права доступа")
+            elif error.status == 404:
+                print(f"Ошибка 404: Объект с тегом #{clean_tag} не найден")
+            elif error.status == 429:
+                print("Ошибка 429: Превышен лимит запросов к API")
+        elif isinstance(error, CircuitOpenError):
+            print(f"Запрос {action} пропущен: {error}")
+        elif isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            print(f"Ошибка сети при получении {action}: {error!r}")
+        else:
+            print(f"Неожиданная ошибка при получении {action}: {error!r}")
+            traceback.print_exc()
+    
+    async def get_clan_info(self, clan_tag: str, use_cache: bool = True, allow_stale: bool = True) -> Optional[Clan]:
+        """Получить информацию о клане"""
+        clean_tag = normalize_tag(clan_tag)
+        try:
+            return await self._cached(
+                ("clan", clean_tag), CR_CACHE_TTL_CLAN, use_cache,
+                lambda: self._fetch_clan_info(clean_tag), allow_stale
+            )
+        except Exception as e:
+            self._report_error("информации о клане", clean_tag, e)
             return None
     
-    async def get_clan_members(self, clan_tag: str) -> Optional[List[Dict]]:
+    async def _fetch_clan_info(self, clean_tag: str) -> Clan:
+        """Запросить информацию о клане из API"""
+        return Clan.from_dict(await self._get_json(f"{self.base_url}/clans/%23{clean_tag}"))
+    
+    async def get_clan_members(self, clan_tag: str, use_cache: bool = True, allow_stale: bool = True) -> Optional[List[Member]]:
         """Получить список участников клана"""
+        clean_tag = normalize_tag(clan_tag)
         try:
-            clean_tag = clan_tag.replace('#', '').upper()
-            url = f"{self.base_url}/clans/%23{clean_tag}/members"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get("items", [])
-                    else:
-                        error_text = await response.text()
-                        print(f"Ошибка API при получении участников клана: статус {response.status}")
-                        print(f"URL: {url}")
-                        print(f"Ответ: {error_text[:200]}")
-                        if response.status == 403:
-                            print("Ошибка 403: Проверьте API токен и его права доступа")
-                        elif response.status == 404:
-                            print(f"Ошибка 404: Клан с тегом #{clean_tag} не найден")
-                        elif response.status == 429:
-                            print("Ошибка 429: Превышен лимит запросов к API")
-                        return None
-        except aiohttp.ClientError as e:
-            print(f"Ошибка сети при получении участников клана: {e}")
-            return None
+            return await self._cached(
+                ("members", clean_tag), CR_CACHE_TTL_MEMBERS, use_cache,
+                lambda: self._fetch_clan_members(clean_tag), allow_stale
+            )
         except Exception as e:
-            print(f"Неожиданная ошибка при получении участников клана: {e}")
-            import traceback
-            traceback.print_exc()
+            self._report_error("участников клана", clean_tag, e)
             return None
     
-    async def get_player_info(self, player_tag: str) -> Optional[Dict]:
+    async def _fetch_clan_members(self, clean_tag: str) -> List[Member]:
+        """Запросить список участников клана из API"""
+        data = await self._get_json(f"{self.base_url}/clans/%23{clean_tag}/members")
+        return [Member.from_dict(item) for item in data.get("items", [])]
+    
+    async def get_player_info(self, player_tag: str, use_cache: bool = True) -> Optional[Player]:
         """Получить информацию об игроке"""
+        clean_tag = normalize_tag(player_tag)
         try:
-            url = f"{self.base_url}/players/%23{player_tag.replace('#', '')}"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    return None
+            return await self._get_player_info_strict(clean_tag, use_cache)
         except Exception as e:
-            print(f"Ошибка при получении информации об игроке: {e}")
+            self._report_error("информации об игроке", clean_tag, e)
             return None
     
-    async def get_clan_war(self, clan_tag: str) -> Optional[Dict]:
+    async def _get_player_info_strict(self, clean_tag: str, use_cache: bool = True) -> Player:
+        """Получить информацию об игроке, выбрасывая исключение при ошибке"""
+        async def fetch() -> Player:
+            return Player.from_dict(await self._get_json(f"{self.base_url}/players/%23{clean_tag}"))
+        
+        return await self._cached(("player", clean_tag), CR_CACHE_TTL_PLAYER, use_cache, fetch)
+    
+    async def get_clan_war(self, clan_tag: str, use_cache: bool = True, allow_stale: bool = True) -> Optional[War]:
         """Получить информацию о текущей клановой войне"""
+        clean_tag = normalize_tag(clan_tag)
         try:
-            url = f"{self.base_url}/clans/%23{clan_tag.replace('#', '')}/currentwar"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    return None
+            return await self.get_clan_war_strict(clean_tag, use_cache, allow_stale)
         except Exception as e:
-            print(f"Ошибка при получении информации о войне: {e}")
+            self._report_error("информации о войне", clean_tag, e)
             return None
     
-    async def get_player_battle_log(self, player_tag: str) -> Optional[List[Dict]]:
+    async def get_clan_war_strict(self, clan_tag: str, use_cache: bool = True,
+                                  allow_stale: bool = True) -> War:
+        """Получить информацию о текущей клановой войне, выбрасывая исключение при ошибке"""
+        clean_tag = normalize_tag(clan_tag)
+        return await self._cached(
+            ("war", clean_tag), CR_CACHE_TTL_WAR, use_cache,
+            lambda: self._fetch_clan_war(clean_tag), allow_stale
+        )
+    
+    async def _fetch_clan_war(self, clean_tag: str) -> War:
+        """Запросить информацию о текущей клановой войне из API"""
+        return War.from_dict(await self._get_json(f"{self.base_url}/clans/%23{clean_tag}/currentwar"))
+    
+    async def get_player_battle_log(self, player_tag: str, use_cache: bool = True) -> Optional[List[Dict]]:
         """Получить историю битв игрока"""
+        clean_tag = normalize_tag(player_tag)
         try:
-            url = f"{self.base_url}/players/%23{player_tag.replace('#', '')}/battlelog"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data if isinstance(data, list) else []
-                    return None
+            return await self._get_battle_log_strict(clean_tag, use_cache)
         except Exception as e:
-            print(f"Ошибка при получении истории битв: {e}")
+            self._report_error("истории битв", clean_tag, e)
             return None
+    
+    async def _get_battle_log_strict(self, clean_tag: str, use_cache: bool = True) -> List[Dict]:
+        """Получить историю битв игрока, выбрасывая исключение при ошибке"""
+        async def fetch() -> List[Dict]:
+            data = await self._get_json(f"{self.base_url}/players/%23{clean_tag}/battlelog")
+            return data if isinstance(data, list) else []
+        
+        return await self._cached(("battlelog", clean_tag), CR_CACHE_TTL_BATTLELOG, use_cache, fetch)
+    
+    def cached_at(self, kind: str, tag: str) -> Optional[datetime]:
+        """Когда в кэш были записаны данные ("clan", "members", "war", "player", "battlelog")"""
+        return self.cache.stored_at((kind, normalize_tag(tag)))
+    
+    def fetch_players(self, tags: Iterable[str], use_cache: bool = True) -> AsyncIterator[BulkResult]:
+        """Получить профили нескольких игроков.
+        
+        Запросы выполняются параллельно (не более CR_API_BULK_CONCURRENCY
+        одновременно) с фоновым приоритетом лимита API. Результаты отдаются
+        по мере готовности; ошибка по одному тегу не прерывает остальные.
+        
+            async for result in cr_api.fetch_players(tags):
+                if result.ok:
+                    ...
+        """
+        return self._fetch_bulk(tags, lambda tag: self._get_player_info_strict(tag, use_cache))
+    
+    def fetch_battle_logs(self, tags: Iterable[str], use_cache: bool = True) -> AsyncIterator[BulkResult]:
+        """Получить историю битв нескольких игроков (аналогично fetch_players)"""
+        return self._fetch_bulk(tags, lambda tag: self._get_battle_log_strict(tag, use_cache))
+    
+    async def _fetch_bulk(self, tags: Iterable[str],
+                          fetch: Callable[[str], Awaitable[Any]]) -> AsyncIterator[BulkResult]:
+        """Параллельно выполнить fetch для каждого тега и отдавать результаты по мере готовности"""
+        # Убираем дубликаты, сохраняя порядок
+        clean_tags = list(dict.fromkeys(normalize_tag(tag) for tag in tags))
+        if not clean_tags:
+            return
+        
+        semaphore = asyncio.Semaphore(CR_API_BULK_CONCURRENCY)
+        
+        async def run(clean_tag: str) -> BulkResult:
+            async with semaphore:
+                try:
+                    return BulkResult(f"#{clean_tag}", await fetch(clean_tag), None)
+                except CRAPIError as e:
+                    return BulkResult(f"#{clean_tag}", None, f"статус {e.status}")
+                except Exception as e:
+                    return BulkResult(f"#{clean_tag}", None, repr(e))
+        
+        with request_priority(PRIORITY_BACKGROUND):
+            tasks = [asyncio.ensure_future(run(tag)) for tag in clean_tags]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Если потребитель прервал итерацию, отменяем оставшиеся запросы
+            for task in tasks:
+                task.cancel()
 
 
 cr_api = ClashRoyaleAPI()
-
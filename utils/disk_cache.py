@@ -0,0 +1,70 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+from utils.json_codec import json_loads
+
+
+class DiskCache:
+    """Кэш в SQLite с временем жизни записей, переживающий перезапуск бота.
+    
+    Значения хранятся в JSON. При превышении max_entries удаляются
+    самые старые записи. Методы синхронные - из асинхронного кода их
+    следует вызывать через asyncio.to_thread().
+    """
+    
+    def __init__(self, db_path: str, max_entries: int = 2000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_stored_at ON cache(stored_at)")
+        self._conn.commit()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Получить значение, если оно есть и не устарело"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return json_loads(row[0])
+    
+    def set(self, key: str, value: Any, ttl: float):
+        """Сохранить значение на ttl секунд"""
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at)
+                VALUES (?, ?, ?, ?)
+            """, (key, data, now, now + ttl))
+            self._evict(now)
+            self._conn.commit()
+    
+    def _evict(self, now: float):
+        """Удалить устаревшие записи и самые старые сверх лимита"""
+        self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        self._conn.execute("""
+            DELETE FROM cache WHERE key IN (
+                SELECT key FROM cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+    
+    def close(self):
+        """Закрыть соединение"""
+        with self._lock:
+            self._conn.close()
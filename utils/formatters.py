@@ -1,20 +1,29 @@
-from typing import List, Dict
+from datetime import datetime
+from typing import List, Optional
+from utils.models import Clan, Member, Player, War
 
 
-def format_clan_info(clan_data: Dict) -> str:
+def format_data_as_of(fetched_at: Optional[datetime]) -> str:
+    """Пометка о том, что показаны последние известные данные"""
+    if not fetched_at:
+        return ""
+    return f"\n\n🕒 <i>Данные на {fetched_at:%H:%M} (API временно недоступен)</i>"
+
+
+def format_clan_info(clan_data: Optional[Clan]) -> str:
     """Форматирование информации о клане"""
     if not clan_data:
         return "❌ Не удалось получить информацию о клане"
     
-    name = clan_data.get("name", "N/A")
-    tag = clan_data.get("tag", "N/A")
-    description = clan_data.get("description", "Нет описания")
-    members = clan_data.get("members", 0)
-    score = clan_data.get("clanScore", 0)
-    donations = clan_data.get("donationsPerWeek", 0)
-    location = clan_data.get("location", {}).get("name", "Не указано")
-    type_clan = clan_data.get("type", "open")
-    required_trophies = clan_data.get("requiredTrophies", 0)
+    name = clan_data.name
+    tag = clan_data.tag
+    description = clan_data.description
+    members = clan_data.members_count
+    score = clan_data.clan_score
+    donations = clan_data.donations_per_week
+    location = clan_data.location
+    type_clan = clan_data.clan_type
+    required_trophies = clan_data.required_trophies
     
     text = f"🏰 <b>{name}</b> {tag}\n\n"
     text += f"📝 <b>Описание:</b> {description}\n"
@@ -28,35 +37,35 @@ def format_clan_info(clan_data: Dict) -> str:
     return text
 
 
-def format_player_stats(player_data: Dict) -> str:
+def format_player_stats(player_data: Optional[Player]) -> str:
     """Форматирование статистики игрока"""
     if not player_data:
         return "❌ Не удалось получить информацию об игроке"
     
-    name = player_data.get("name", "N/A")
-    tag = player_data.get("tag", "N/A")
-    exp_level = player_data.get("expLevel", 0)
-    trophies = player_data.get("trophies", 0)
-    best_trophies = player_data.get("bestTrophies", 0)
-    wins = player_data.get("wins", 0)
-    losses = player_data.get("losses", 0)
-    draws = player_data.get("draws", 0)
-    total_battles = wins + losses + draws
+    name = player_data.name
+    tag = player_data.tag
+    exp_level = player_data.exp_level
+    trophies = player_data.trophies
+    best_trophies = player_data.best_trophies
+    wins = player_data.wins
+    losses = player_data.losses
+    draws = player_data.draws
+    total_battles = player_data.total_battles
     win_rate = (wins / total_battles * 100) if total_battles > 0 else 0
     
     # Трехкоронные победы
-    three_crown_wins = player_data.get("threeCrownWins", 0)
+    three_crown_wins = player_data.three_crown_wins
     
-    # Карты
-    cards = player_data.get("cards", [])
-    cards_found = len([c for c in cards if c.get("maxLevel", 0) > 0])
+    # Карты (найденные карты посчитаны при разборе ответа)
+    cards_found = player_data.cards_found
+    cards_total = player_data.cards_total
     
     # Донаты
-    total_donations = player_data.get("totalDonations", 0)
+    total_donations = player_data.total_donations
     
     # Войны
-    war_day_wins = player_data.get("warDayWins", 0)
-    clan_cards_collected = player_data.get("clanCardsCollected", 0)
+    war_day_wins = player_data.war_day_wins
+    clan_cards_collected = player_data.clan_cards_collected
     
     text = f"👤 <b>{name}</b> {tag}\n\n"
     text += f"⭐ <b>Уровень:</b> {exp_level}\n"
@@ -68,7 +77,7 @@ def format_player_stats(player_data: Dict) -> str:
     text += f"   Всего: {total_battles:,}\n"
     text += f"   Винрейт: {win_rate:.1f}%\n"
     text += f"   Трехкоронных побед: {three_crown_wins:,}\n\n"
-    text += f"🃏 <b>Карты:</b> {cards_found}/{len(cards)}\n"
+    text += f"🃏 <b>Карты:</b> {cards_found}/{cards_total}\n"
     text += f"🎁 <b>Всего пожертвовано:</b> {total_donations:,}\n"
     text += f"⚔️ <b>Побед в войнах:</b> {war_day_wins}\n"
     text += f"📦 <b>Карт собрано в войнах:</b> {clan_cards_collected:,}"
@@ -76,7 +85,7 @@ def format_player_stats(player_data: Dict) -> str:
     return text
 
 
-def format_clan_members(members: List[Dict]) -> str:
+def format_clan_members(members: List[Member]) -> str:
     """Форматирование списка участников клана"""
     if not members:
         return "❌ Не удалось получить список участников"
@@ -84,14 +93,14 @@ def format_clan_members(members: List[Dict]) -> str:
     text = f"👥 <b>Участники клана ({len(members)}):</b>\n\n"
     
     # Сортируем по трофеям (по убыванию)
-    sorted_members = sorted(members, key=lambda x: x.get("trophies", 0), reverse=True)
+    sorted_members = sorted(members, key=lambda x: x.trophies, reverse=True)
     
     for i, member in enumerate(sorted_members[:20], 1):  # Показываем топ-20
-        name = member.get("name", "N/A")
-        role = member.get("role", "member")
-        trophies = member.get("trophies", 0)
-        donations = member.get("donations", 0)
-        donations_received = member.get("donationsReceived", 0)
+        name = member.name
+        role = member.role
+        trophies = member.trophies
+        donations = member.donations
+        donations_received = member.donations_received
         
         role_emoji = {
             "leader": "👑",
@@ -109,14 +118,14 @@ def format_clan_members(members: List[Dict]) -> str:
     return text
 
 
-def format_war_info(war_data: Dict) -> str:
+def format_war_info(war_data: Optional[War]) -> str:
     """Форматирование информации о клановой войне"""
     if not war_data:
         return "❌ Нет активной клановой войны"
     
-    state = war_data.get("state", "unknown")
-    clan = war_data.get("clan", {})
-    opponent = war_data.get("opponent", {})
+    state = war_data.state
+    clan = war_data.clan
+    opponent = war_data.opponent
     
     # Определяем фазу войны
     if state == "collectionDay":
@@ -131,10 +140,10 @@ def format_war_info(war_data: Dict) -> str:
     text = f"{phase}\n\n"
     
     # Информация о нашем клане
-    clan_name = clan.get("name", "N/A")
-    clan_tag = clan.get("tag", "N/A")
-    clan_crowns = clan.get("crowns", 0)
-    clan_participants = len(clan.get("participants", []))
+    clan_name = clan.name if clan else "N/A"
+    clan_tag = clan.tag if clan else "N/A"
+    clan_crowns = clan.crowns if clan else 0
+    clan_participants = len(war_data.participants)
     
     text += f"🏰 <b>Ваш клан:</b> {clan_name} {clan_tag}\n"
     text += f"👥 Участников: {clan_participants}\n"
@@ -144,10 +153,10 @@ def format_war_info(war_data: Dict) -> str:
     
     # Информация о противнике
     if opponent:
-        opponent_name = opponent.get("name", "N/A")
-        opponent_tag = opponent.get("tag", "N/A")
-        opponent_crowns = opponent.get("crowns", 0)
-        opponent_participants = len(opponent.get("participants", []))
+        opponent_name = opponent.name
+        opponent_tag = opponent.tag
+        opponent_crowns = opponent.crowns
+        opponent_participants = len(opponent.participants)
         
         text += f"\n⚔️ <b>Противник:</b> {opponent_name} {opponent_tag}\n"
         text += f"👥 Участников: {opponent_participants}\n"
@@ -159,30 +168,22 @@ def format_war_info(war_data: Dict) -> str:
     return text
 
 
-def format_player_war_stats(war_data: Dict, player_tag: str) -> str:
+def format_player_war_stats(war_data: Optional[War], player_tag: str) -> str:
     """Форматирование статистики игрока в войне"""
     if not war_data:
         return "❌ Нет активной клановой войны"
     
-    clean_tag = player_tag.replace("#", "").upper()
-    participants = war_data.get("clan", {}).get("participants", [])
-    
-    # Ищем игрока среди участников
-    player = None
-    for participant in participants:
-        tag = participant.get("tag", "").replace("#", "").upper()
-        if tag == clean_tag:
-            player = participant
-            break
+    # Ищем игрока по индексу участников
+    player = war_data.participant(player_tag)
     
     if not player:
         return f"❌ Игрок {player_tag} не найден среди участников войны"
     
-    name = player.get("name", "N/A")
-    cards_earned = player.get("cardsEarned", 0)
-    battles_played = player.get("battlesPlayed", 0)
-    battles_remaining = player.get("battlesRemaining", 0)
-    wins = player.get("wins", 0)
+    name = player.name
+    cards_earned = player.cards_earned
+    battles_played = player.battles_played
+    battles_remaining = player.battles_remaining
+    wins = player.wins
     
     text = f"👤 <b>{name}</b> {player_tag}\n\n"
     text += f"📦 <b>Карт собрано:</b> {cards_earned}\n"
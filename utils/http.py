@@ -0,0 +1,21 @@
+import aiohttp
+from typing import Dict, Optional
+from config import (
+    CR_API_TIMEOUT, CR_API_CONNECT_TIMEOUT, CR_API_POOL_SIZE,
+    CR_API_DNS_CACHE_TTL, CR_API_KEEPALIVE_TIMEOUT
+)
+
+
+def create_session(headers: Optional[Dict[str, str]] = None) -> aiohttp.ClientSession:
+    """Создать долгоживущую HTTP-сессию с пулом keep-alive соединений"""
+    connector = aiohttp.TCPConnector(
+        limit=CR_API_POOL_SIZE,
+        limit_per_host=CR_API_POOL_SIZE,
+        ttl_dns_cache=CR_API_DNS_CACHE_TTL,
+        keepalive_timeout=CR_API_KEEPALIVE_TIMEOUT
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=CR_API_TIMEOUT,
+        sock_connect=CR_API_CONNECT_TIMEOUT
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
@@ -0,0 +1,35 @@
+import json
+from typing import Any, Callable, Union
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+JSONDecoder = Callable[[Union[str, bytes]], Any]
+
+
+def _default_decoder() -> JSONDecoder:
+    """Самый быстрый доступный декодер JSON"""
+    if orjson is not None:
+        return orjson.loads
+    return json.loads
+
+
+_decoder: JSONDecoder = _default_decoder()
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """Разобрать JSON текущим декодером"""
+    return _decoder(data)
+
+
+def set_json_decoder(decoder: JSONDecoder):
+    """Заменить декодер JSON (например, на ujson или msgspec)"""
+    global _decoder
+    _decoder = decoder
+
+
+def json_decoder_name() -> str:
+    """Название текущего декодера (для диагностики)"""
+    return getattr(_decoder, "__module__", None) or repr(_decoder)
@@ -0,0 +1,280 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, TypeVar
+
+
+def normalize_tag(tag: Optional[str]) -> str:
+    """Канонический вид тега: без #, без пробелов, в верхнем регистре"""
+    if not tag:
+        return ""
+    return tag.strip().replace("#", "").upper()
+
+
+def normalize_nickname(nickname: Optional[str]) -> str:
+    """Ник для поиска без учета регистра (casefold работает и для кириллицы)"""
+    if not nickname:
+        return ""
+    return nickname.strip().casefold()
+
+
+def parse_api_time(value: Optional[str]) -> Optional[datetime]:
+    """Время из ответа API (формат "20240101T093000.000Z") в UTC"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y%m%dT%H%M%S.%fZ").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+T = TypeVar("T")
+
+
+def index_by_tag(items: Iterable[T]) -> Dict[str, T]:
+    """Построить индекс канонический тег -> объект"""
+    return {item.key: item for item in items}
+
+
+class Member:
+    """Участник клана"""
+    
+    __slots__ = (
+        "tag", "key", "name", "role", "exp_level", "trophies",
+        "donations", "donations_received", "clan_rank"
+    )
+    
+    def __init__(self, tag: str, name: str, role: str = "member", exp_level: int = 0,
+                 trophies: int = 0, donations: int = 0, donations_received: int = 0,
+                 clan_rank: int = 0):
+        self.key = normalize_tag(tag)
+        self.tag = f"#{self.key}"
+        self.name = name
+        self.role = role
+        self.exp_level = exp_level
+        self.trophies = trophies
+        self.donations = donations
+        self.donations_received = donations_received
+        self.clan_rank = clan_rank
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Member":
+        return cls(
+            tag=data.get("tag", ""),
+            name=data.get("name", "N/A"),
+            role=data.get("role", "member"),
+            exp_level=data.get("expLevel", 0),
+            trophies=data.get("trophies", 0),
+            donations=data.get("donations", 0),
+            donations_received=data.get("donationsReceived", 0),
+            clan_rank=data.get("clanRank", 0)
+        )
+
+
+class Clan:
+    """Информация о клане"""
+    
+    __slots__ = (
+        "tag", "key", "name", "description", "clan_type", "members_count", "clan_score",
+        "donations_per_week", "location", "required_trophies", "members"
+    )
+    
+    def __init__(self, tag: str, name: str, description: str = "Нет описания",
+                 clan_type: str = "open", members_count: int = 0, clan_score: int = 0,
+                 donations_per_week: int = 0, location: str = "Не указано",
+                 required_trophies: int = 0, members: Optional[List[Member]] = None):
+        self.key = normalize_tag(tag)
+        self.tag = f"#{self.key}"
+        self.name = name
+        self.description = description
+        self.clan_type = clan_type
+        self.members_count = members_count
+        self.clan_score = clan_score
+        self.donations_per_week = donations_per_week
+        self.location = location
+        self.required_trophies = required_trophies
+        self.members = members or []
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Clan":
+        return cls(
+            tag=data.get("tag", ""),
+            name=data.get("name", "N/A"),
+            description=data.get("description", "Нет описания"),
+            clan_type=data.get("type", "open"),
+            members_count=data.get("members", 0),
+            clan_score=data.get("clanScore", 0),
+            donations_per_week=data.get("donationsPerWeek", 0),
+            location=(data.get("location") or {}).get("name", "Не указано"),
+            required_trophies=data.get("requiredTrophies", 0),
+            members=[Member.from_dict(m) for m in data.get("memberList", [])]
+        )
+
+
+class Participant:
+    """Участник клановой войны"""
+    
+    __slots__ = (
+        "tag", "key", "name", "cards_earned", "battles_played",
+        "battles_remaining", "wins", "collection_day_battles_played"
+    )
+    
+    def __init__(self, tag: str, name: str, cards_earned: int = 0, battles_played: int = 0,
+                 battles_remaining: int = 0, wins: int = 0,
+                 collection_day_battles_played: int = 0):
+        self.key = normalize_tag(tag)
+        self.tag = f"#{self.key}"
+        self.name = name
+        self.cards_earned = cards_earned
+        self.battles_played = battles_played
+        self.battles_remaining = battles_remaining
+        self.wins = wins
+        self.collection_day_battles_played = collection_day_battles_played
+    
+    @property
+    def max_battles(self) -> int:
+        """Всего доступно битв"""
+        return self.battles_played + self.battles_remaining
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Participant":
+        return cls(
+            tag=data.get("tag", ""),
+            name=data.get("name", "N/A"),
+            cards_earned=data.get("cardsEarned", 0),
+            battles_played=data.get("battlesPlayed", 0),
+            battles_remaining=data.get("battlesRemaining", 0),
+            wins=data.get("wins", 0),
+            collection_day_battles_played=data.get("collectionDayBattlesPlayed", 0)
+        )
+
+
+class WarClan:
+    """Клан в клановой войне"""
+    
+    __slots__ = ("tag", "key", "name", "crowns", "participants")
+    
+    def __init__(self, tag: str, name: str, crowns: int = 0,
+                 participants: Optional[List[Participant]] = None):
+        self.key = normalize_tag(tag)
+        self.tag = f"#{self.key}"
+        self.name = name
+        self.crowns = crowns
+        self.participants = participants or []
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "WarClan":
+        return cls(
+            tag=data.get("tag", ""),
+            name=data.get("name", "N/A"),
+            crowns=data.get("crowns", 0),
+            participants=[Participant.from_dict(p) for p in data.get("participants", [])]
+        )
+
+
+class War:
+    """Текущая клановая война"""
+    
+    __slots__ = ("state", "clan", "opponent", "participants", "war_end_time", "_participants_by_tag")
+    
+    def __init__(self, state: str, clan: Optional[WarClan] = None,
+                 opponent: Optional[WarClan] = None,
+                 participants: Optional[List[Participant]] = None,
+                 war_end_time: Optional[datetime] = None):
+        self.state = state
+        self.clan = clan
+        self.opponent = opponent
+        # Окончание дня битвы (UTC) - однозначно определяет войну
+        self.war_end_time = war_end_time
+        # Участники нашего клана: из корня ответа или из блока clan
+        if participants is None:
+            participants = clan.participants if clan else []
+        self.participants = participants
+        self._participants_by_tag = index_by_tag(participants)
+    
+    @property
+    def is_active(self) -> bool:
+        """Идет ли война (день сбора карт или день битвы)"""
+        return self.state in ("collectionDay", "warDay")
+    
+    def participant(self, tag: str) -> Optional[Participant]:
+        """Найти участника войны по тегу"""
+        return self._participants_by_tag.get(normalize_tag(tag))
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "War":
+        clan = data.get("clan")
+        opponent = data.get("opponent")
+        participants = data.get("participants")
+        return cls(
+            state=data.get("state", "unknown"),
+            clan=WarClan.from_dict(clan) if clan else None,
+            opponent=WarClan.from_dict(opponent) if opponent else None,
+            participants=[Participant.from_dict(p) for p in participants] if participants else None,
+            war_end_time=parse_api_time(data.get("warEndTime"))
+        )
+
+
+class Player:
+    """Профиль игрока"""
+    
+    __slots__ = (
+        "tag", "key", "name", "exp_level", "trophies", "best_trophies", "wins",
+        "losses", "draws", "three_crown_wins", "cards_total", "cards_found",
+        "total_donations", "war_day_wins", "clan_cards_collected"
+    )
+    
+    def __init__(self, tag: str, name: str, exp_level: int = 0, trophies: int = 0,
+                 best_trophies: int = 0, wins: int = 0, losses: int = 0, draws: int = 0,
+                 three_crown_wins: int = 0, cards_total: int = 0, cards_found: int = 0,
+                 total_donations: int = 0, war_day_wins: int = 0,
+                 clan_cards_collected: int = 0):
+        self.key = normalize_tag(tag)
+        self.tag = f"#{self.key}"
+        self.name = name
+        self.exp_level = exp_level
+        self.trophies = trophies
+        self.best_trophies = best_trophies
+        self.wins = wins
+        self.losses = losses
+        self.draws = draws
+        self.three_crown_wins = three_crown_wins
+        self.cards_total = cards_total
+        self.cards_found = cards_found
+        self.total_donations = total_donations
+        self.war_day_wins = war_day_wins
+        self.clan_cards_collected = clan_cards_collected
+    
+    @property
+    def total_battles(self) -> int:
+        return self.wins + self.losses + self.draws
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Player":
+        """Профиль из ответа официального API"""
+        cards = data.get("cards", [])
+        return cls(
+            tag=data.get("tag", ""),
+            name=data.get("name", "N/A"),
+            exp_level=data.get("expLevel", 0),
+            trophies=data.get("trophies", 0),
+            best_trophies=data.get("bestTrophies", 0),
+            wins=data.get("wins", 0),
+            losses=data.get("losses", 0),
+            draws=data.get("draws", 0),
+            three_crown_wins=data.get("threeCrownWins", 0),
+            cards_total=len(cards),
+            cards_found=sum(1 for c in cards if c.get("maxLevel", 0) > 0),
+            total_donations=data.get("totalDonations", 0),
+            war_day_wins=data.get("warDayWins", 0),
+            clan_cards_collected=data.get("clanCardsCollected", 0)
+        )
+    
+    @classmethod
+    def from_royaleapi(cls, data: Dict) -> "Player":
+        """Профиль из данных, разобранных со страницы RoyaleAPI"""
+        return cls(
+            tag=data.get("tag", ""),
+            name=data.get("name", "N/A"),
+            exp_level=data.get("level", 0),
+            trophies=data.get("trophies", 0),
+            wins=data.get("wins", 0)
+        )
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import NamedTuple, Optional
+from utils.cr_api import cr_api
+from utils.royaleapi import royale_api
+from utils.models import Player, normalize_tag
+from config import PLAYER_HEDGE_DELAY
+
+logger = logging.getLogger(__name__)
+
+# Источник профиля игрока
+SOURCE_OFFICIAL = "official"
+SOURCE_ROYALEAPI = "royaleapi"
+
+
+class PlayerLookup(NamedTuple):
+    """Результат поиска игрока"""
+    player: Optional[Player]
+    source: Optional[str]
+    # Последние известные данные официального API (API недоступен) - когда они получены
+    stale_since: Optional[datetime] = None
+
+
+NOT_FOUND = PlayerLookup(None, None)
+
+
+async def _from_official(clean_tag: str) -> PlayerLookup:
+    """Профиль из официального API"""
+    player = await cr_api.get_player_info(clean_tag)
+    if not player:
+        return NOT_FOUND
+    # При недоступном API кэш отдает последние известные данные
+    stale_since = None if cr_api.breaker.is_closed else cr_api.cached_at("player", clean_tag)
+    return PlayerLookup(player, SOURCE_OFFICIAL, stale_since)
+
+
+async def _from_royaleapi(clean_tag: str) -> PlayerLookup:
+    """Профиль со страницы RoyaleAPI, приведенный к модели Player"""
+    data = await royale_api.get_player_stats(clean_tag)
+    return PlayerLookup(Player.from_royaleapi(data), SOURCE_ROYALEAPI) if data else NOT_FOUND
+
+
+async def lookup_player(player_tag: str) -> PlayerLookup:
+    """Найти игрока с "подстраховочным" запросом к RoyaleAPI.
+    
+    Сначала запрашивается официальный API. Если он не ответил за
+    PLAYER_HEDGE_DELAY секунд (примерно p95 его задержки), параллельно
+    запускается RoyaleAPI: побеждает первый валидный результат, второй
+    запрос отменяется. Если официальный API быстро вернул ошибку,
+    RoyaleAPI используется как обычный запасной источник.
+    
+    Возвращает профиль вместе с источником, который ответил.
+    """
+    clean_tag = normalize_tag(player_tag)
+    official = asyncio.ensure_future(_from_official(clean_tag))
+    pending = {official}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=PLAYER_HEDGE_DELAY)
+        if done:
+            result = official.result()
+            return result if result.player else await _from_royaleapi(clean_tag)
+        
+        logger.info(f"Официальный API не ответил за {PLAYER_HEDGE_DELAY} сек, запрашиваю RoyaleAPI для #{clean_tag}")
+        pending.add(asyncio.ensure_future(_from_royaleapi(clean_tag)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result().player:
+                    return task.result()
+        return NOT_FOUND
+    finally:
+        # Проигравший (или уже ненужный) запрос отменяем
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator
+
+# Приоритеты запросов: чем меньше число, тем выше приоритет
+PRIORITY_INTERACTIVE = 0  # ответы на команды пользователей
+PRIORITY_BACKGROUND = 1  # фоновые задачи (напоминания, синхронизация ролей)
+PRIORITY_BROADCAST = 2  # массовые рассылки из админ-панели
+
+_current_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+
+def current_priority() -> int:
+    """Приоритет запросов в текущем контексте"""
+    return _current_priority.get()
+
+
+@contextmanager
+def request_priority(priority: int) -> Iterator[None]:
+    """Выполнить блок кода с указанным приоритетом запросов.
+    
+    Приоритет хранится в contextvar и наследуется задачами, созданными внутри блока.
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов (token bucket) с приоритетными очередями.
+    
+    Пока есть ожидающие запросы с более высоким приоритетом,
+    запросы с более низким приоритетом токены не получают.
+    """
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting: Dict[int, int] = defaultdict(int)
+    
+    def _refill(self):
+        """Пополнить токены за прошедшее время"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def _has_higher_priority_waiters(self, priority: int) -> bool:
+        """Есть ли ожидающие запросы с более высоким приоритетом"""
+        return any(count for p, count in self._waiting.items() if p < priority and count > 0)
+    
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        """Дождаться свободного токена"""
+        self._waiting[priority] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                
+                self._refill()
+                if self._tokens >= 1 and not self._has_higher_priority_waiters(priority):
+                    self._tokens -= 1
+                    return
+                
+                await asyncio.sleep(max((1 - self._tokens) / self.rate, 0.01))
+        finally:
+            self._waiting[priority] -= 1
+    
+    def pause(self, seconds: float):
+        """Приостановить выдачу токенов (например, по заголовку Retry-After)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def queue_depth(self) -> Dict[int, int]:
+        """Количество ожидающих запросов по приоритетам"""
+        return {p: count for p, count in self._waiting.items() if count > 0}
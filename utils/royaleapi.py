@@ -1,8 +1,106 @@
+import asyncio
 import aiohttp
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Optional, Dict, List
 from bs4 import BeautifulSoup
 import re
-from config import ROYALEAPI_BASE_URL
+from config import (
+    ROYALEAPI_BASE_URL, ROYALEAPI_PARSER_WORKERS, ROYALEAPI_PARSER_PROCESSES,
+    ROYALEAPI_CACHE_PATH, ROYALEAPI_CACHE_TTL, ROYALEAPI_CACHE_MAX_ENTRIES
+)
+from utils.http import create_session
+from utils.disk_cache import DiskCache
+
+# Быстрый парсер lxml, если он установлен
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Регулярные выражения компилируются один раз при импорте модуля
+PLAYER_NAME_CLASS_RE = re.compile('player.*name', re.I)
+TROPHIES_RE = re.compile(r'(\d{1,3}(?:,\d{3})*)\s*(?:trophies|трофеев)', re.I)
+LEVEL_RE = re.compile(r'level\s*(\d+)|уровень\s*(\d+)', re.I)
+WINS_RE = re.compile(r'(\d{1,3}(?:,\d{3})*)\s*(?:wins|побед)', re.I)
+WAR_SECTION_CLASS_RE = re.compile('war|война', re.I)
+WAR_STATUS_RE = re.compile('Collection|Battle|Сбор|Битва', re.I)
+WAR_MEMBER_CLASS_RE = re.compile('member|участник', re.I)
+WORD_RE = re.compile(r'\w+')
+
+
+def parse_player_page(html: str, clean_tag: str) -> Dict:
+    """Разобрать страницу игрока RoyaleAPI (выполняется в пуле парсеров)"""
+    soup = BeautifulSoup(html, HTML_PARSER)
+    
+    # Парсим основную информацию
+    player_data = {}
+    
+    # Имя игрока
+    name_elem = soup.find('h1', class_=PLAYER_NAME_CLASS_RE)
+    if name_elem:
+        player_data['name'] = name_elem.get_text(strip=True)
+    
+    # Пытаемся найти трофеи в различных местах страницы
+    # Ищем все элементы с текстом, содержащим "trophies" или числа
+    all_text = soup.get_text()
+    trophies_match = TROPHIES_RE.search(all_text)
+    if trophies_match:
+        player_data['trophies'] = int(trophies_match.group(1).replace(',', ''))
+    
+    # Ищем уровень
+    level_match = LEVEL_RE.search(all_text)
+    if level_match:
+        player_data['level'] = int(level_match.group(1) or level_match.group(2))
+    
+    # Ищем победы
+    wins_match = WINS_RE.search(all_text)
+    if wins_match:
+        player_data['wins'] = int(wins_match.group(1).replace(',', ''))
+    
+    player_data['tag'] = f"#{clean_tag}"
+    return player_data
+
+
+def is_complete_player(player_data: Optional[Dict]) -> bool:
+    """Профиль разобран полностью: есть имя и трофеи.
+    
+    Страница-заглушка (например, проверка Cloudflare "Just a moment...")
+    разбирается только до тега, такой результат профилем не считается.
+    """
+    return bool(player_data) and bool(player_data.get("name")) and player_data.get("trophies") is not None
+
+
+def is_complete_clan_war(war_data: Optional[Dict]) -> bool:
+    """На странице клана найден раздел войны (у заглушки его нет, результат пустой)"""
+    return bool(war_data) and war_data.get("participants") is not None
+
+
+def parse_clan_war_page(html: str) -> Dict:
+    """Разобрать страницу клана RoyaleAPI (выполняется в пуле парсеров)"""
+    soup = BeautifulSoup(html, HTML_PARSER)
+    
+    war_data = {}
+    
+    # Ищем информацию о текущей войне
+    war_section = soup.find('section', class_=WAR_SECTION_CLASS_RE)
+    if war_section:
+        # Статус войны
+        status_elem = war_section.find(string=WAR_STATUS_RE)
+        if status_elem:
+            war_data['status'] = status_elem.get_text(strip=True)
+        
+        # Участники войны
+        participants = []
+        member_elems = war_section.find_all('div', class_=WAR_MEMBER_CLASS_RE)
+        for member_elem in member_elems:
+            name = member_elem.find(string=WORD_RE)
+            if name:
+                participants.append(name.get_text(strip=True))
+        
+        war_data['participants'] = participants
+    
+    return war_data
 
 
 class RoyaleAPI:
@@ -13,48 +111,97 @@ class RoyaleAPI:
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._parser_pool: Optional[Executor] = None
+        self._disk_cache: Optional[DiskCache] = None
+    
+    async def start(self):
+        """Открыть общую HTTP-сессию, пул парсеров и дисковый кэш (вызывается при запуске бота)"""
+        if self._session is None or self._session.closed:
+            self._session = create_session(self.headers)
+        if self._parser_pool is None:
+            self._parser_pool = self._create_parser_pool()
+        self._get_disk_cache()
+    
+    async def close(self):
+        """Закрыть общую HTTP-сессию, пул парсеров и дисковый кэш (вызывается при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._parser_pool is not None:
+            self._parser_pool.shutdown(wait=False, cancel_futures=True)
+            self._parser_pool = None
+        if self._disk_cache is not None:
+            self._disk_cache.close()
+            self._disk_cache = None
+    
+    def _get_disk_cache(self) -> DiskCache:
+        """Дисковый кэш разобранных страниц (открывается при первом обращении)"""
+        if self._disk_cache is None:
+            self._disk_cache = DiskCache(ROYALEAPI_CACHE_PATH, ROYALEAPI_CACHE_MAX_ENTRIES)
+        return self._disk_cache
+    
+    async def _cache_get(self, key: str) -> Optional[Dict]:
+        """Прочитать разобранные данные из дискового кэша"""
+        try:
+            return await asyncio.to_thread(self._get_disk_cache().get, key)
+        except Exception as e:
+            print(f"Ошибка чтения кэша RoyaleAPI: {e}")
+            return None
+    
+    async def _cache_set(self, key: str, value: Dict):
+        """Сохранить разобранные данные в дисковый кэш"""
+        try:
+            await asyncio.to_thread(self._get_disk_cache().set, key, value, ROYALEAPI_CACHE_TTL)
+        except Exception as e:
+            print(f"Ошибка записи кэша RoyaleAPI: {e}")
+    
+    @staticmethod
+    def _create_parser_pool() -> Executor:
+        """Пул для разбора HTML вне event loop"""
+        if ROYALEAPI_PARSER_PROCESSES:
+            return ProcessPoolExecutor(max_workers=ROYALEAPI_PARSER_WORKERS)
+        return ThreadPoolExecutor(max_workers=ROYALEAPI_PARSER_WORKERS, thread_name_prefix="royaleapi-parser")
+    
+    async def _parse(self, func, *args):
+        """Выполнить разбор страницы в пуле парсеров, не блокируя event loop"""
+        if self._parser_pool is None:
+            self._parser_pool = self._create_parser_pool()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._parser_pool, func, *args)
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получить общую сессию, открыв ее при необходимости"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
     
     async def get_player_stats(self, player_tag: str) -> Optional[Dict]:
         """Получить расширенную статистику игрока с RoyaleAPI"""
         try:
             # Убираем # из тега
             clean_tag = player_tag.replace("#", "").upper()
+            cache_key = f"player:{clean_tag}"
+            cached = await self._cache_get(cache_key)
+            # Неполные записи могли попасть в кэш раньше - их не используем
+            if is_complete_player(cached):
+                return cached
+            
             url = f"{self.base_url}/player/{clean_tag}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        soup = BeautifulSoup(html, 'html.parser')
-                        
-                        # Парсим основную информацию
-                        player_data = {}
-                        
-                        # Имя игрока
-                        name_elem = soup.find('h1', class_=re.compile('player.*name', re.I))
-                        if name_elem:
-                            player_data['name'] = name_elem.get_text(strip=True)
-                        
-                        # Пытаемся найти трофеи в различных местах страницы
-                        # Ищем все элементы с текстом, содержащим "trophies" или числа
-                        all_text = soup.get_text()
-                        trophies_match = re.search(r'(\d{1,3}(?:,\d{3})*)\s*(?:trophies|трофеев)', all_text, re.I)
-                        if trophies_match:
-                            player_data['trophies'] = int(trophies_match.group(1).replace(',', ''))
-                        
-                        # Ищем уровень
-                        level_match = re.search(r'level\s*(\d+)|уровень\s*(\d+)', all_text, re.I)
-                        if level_match:
-                            player_data['level'] = int(level_match.group(1) or level_match.group(2))
-                        
-                        # Ищем победы
-                        wins_match = re.search(r'(\d{1,3}(?:,\d{3})*)\s*(?:wins|побед)', all_text, re.I)
-                        if wins_match:
-                            player_data['wins'] = int(wins_match.group(1).replace(',', ''))
-                        
-                        player_data['tag'] = f"#{clean_tag}"
-                        return player_data
+            session = await self._get_session()
+            async with session.get(url) as response:
+                if response.status != 200:
                     return None
+                html = await response.text()
+            
+            player_data = await self._parse(parse_player_page, html, clean_tag)
+            if not is_complete_player(player_data):
+                # Заглушка вместо страницы игрока: не кэшируем и не отдаем пустой профиль
+                print(f"RoyaleAPI вернул неполную страницу игрока #{clean_tag}")
+                return None
+            await self._cache_set(cache_key, player_data)
+            return player_data
         except Exception as e:
             print(f"Ошибка при получении статистики игрока с RoyaleAPI: {e}")
             return None
@@ -63,40 +210,30 @@ class RoyaleAPI:
         """Получить статистику клановой войны"""
         try:
             clean_tag = clan_tag.replace("#", "").upper()
+            cache_key = f"clan_war:{clean_tag}"
+            cached = await self._cache_get(cache_key)
+            # Пустые записи могли попасть в кэш раньше - их не используем
+            if is_complete_clan_war(cached):
+                return cached
+            
             url = f"{self.base_url}/clan/{clean_tag}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        soup = BeautifulSoup(html, 'html.parser')
-                        
-                        war_data = {}
-                        
-                        # Ищем информацию о текущей войне
-                        war_section = soup.find('section', class_=re.compile('war|война', re.I))
-                        if war_section:
-                            # Статус войны
-                            status_elem = war_section.find(string=re.compile('Collection|Battle|Сбор|Битва', re.I))
-                            if status_elem:
-                                war_data['status'] = status_elem.get_text(strip=True)
-                            
-                            # Участники войны
-                            participants = []
-                            member_elems = war_section.find_all('div', class_=re.compile('member|участник', re.I))
-                            for member_elem in member_elems:
-                                name = member_elem.find(string=re.compile(r'\w+'))
-                                if name:
-                                    participants.append(name.get_text(strip=True))
-                            
-                            war_data['participants'] = participants
-                        
-                        return war_data
+            session = await self._get_session()
+            async with session.get(url) as response:
+                if response.status != 200:
                     return None
+                html = await response.text()
+            
+            war_data = await self._parse(parse_clan_war_page, html)
+            if not is_complete_clan_war(war_data):
+                # Заглушка или страница без раздела войны: не кэшируем пустой результат
+                print(f"RoyaleAPI вернул страницу клана #{clean_tag} без данных о войне")
+                return None
+            await self._cache_set(cache_key, war_data)
+            return war_data
         except Exception as e:
             print(f"Ошибка при получении статистики войны с RoyaleAPI: {e}")
             return None
 
 
 royale_api = RoyaleAPI()
-
@@ -0,0 +1,156 @@
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Union
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from utils.rate_limiter import (
+    TokenBucket, current_priority, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_BROADCAST
+)
+from config import (
+    TELEGRAM_RATE, TELEGRAM_BURST, TELEGRAM_PRIVATE_CHAT_INTERVAL, TELEGRAM_GROUP_CHAT_INTERVAL,
+    TELEGRAM_MAX_FLOOD_WAIT, TELEGRAM_FLOOD_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Полосы очереди (приоритет из utils.rate_limiter -> название для статистики)
+LANE_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BACKGROUND: "reminders",
+    PRIORITY_BROADCAST: "broadcasts",
+}
+
+# Сколько чатов хранить в расписании, прежде чем удалять устаревшие записи
+CHAT_SCHEDULE_PRUNE_SIZE = 1000
+
+
+class LaneStats:
+    """Статистика одной полосы очереди"""
+    
+    __slots__ = ("queued", "sent", "wait_total", "wait_max")
+    
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "wait_avg": self.wait_total / self.sent if self.sent else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+class PrioritySession(AiohttpSession):
+    """Сессия aiogram с общей очередью исходящих запросов.
+    
+    Все запросы к чатам (отправка, редактирование, удаление сообщений) проходят
+    через один token bucket с приоритетами: ответы пользователям, затем
+    напоминания, затем рассылки. Полоса определяется контекстом вызова
+    (request_priority из utils.rate_limiter). Фоновые полосы дополнительно
+    соблюдают интервал между сообщениями в один чат; ответы пользователям его
+    не ждут, но сдвигают. TelegramRetryAfter приостанавливает всю очередь и
+    повторяет запрос, если ждать не дольше max_flood_wait.
+    
+    Служебные запросы без chat_id (getUpdates, answerCallbackQuery) не ограничиваются.
+    """
+    
+    def __init__(self, rate: float, burst: int, private_interval: float, group_interval: float,
+                 max_flood_wait: float, flood_retries: int, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self.max_flood_wait = max_flood_wait
+        self.flood_retries = flood_retries
+        self.flood_waits = 0
+        self._chat_next_at: Dict[Union[int, str], float] = {}
+        self._lanes: Dict[int, LaneStats] = {priority: LaneStats() for priority in LANE_NAMES}
+    
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await super().make_request(bot, method, timeout)
+        
+        priority = current_priority()
+        attempt = 0
+        while True:
+            await self._throttle(chat_id, priority)
+            try:
+                return await super().make_request(bot, method, timeout)
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                # Flood control касается всего бота: притормаживаем всю очередь
+                self.rate_limiter.pause(e.retry_after)
+                self._chat_next_at[chat_id] = time.monotonic() + e.retry_after
+                if attempt >= self.flood_retries or e.retry_after > self.max_flood_wait:
+                    raise
+                attempt += 1
+                logger.warning(
+                    f"Flood control Telegram ({LANE_NAMES.get(priority, priority)}, чат {chat_id}), "
+                    f"пауза {e.retry_after} сек"
+                )
+    
+    async def _throttle(self, chat_id: Union[int, str], priority: int):
+        """Дождаться очереди на отправку и записать время ожидания"""
+        lane = self._lanes.setdefault(priority, LaneStats())
+        started = time.monotonic()
+        lane.queued += 1
+        try:
+            if priority != PRIORITY_INTERACTIVE:
+                await self._wait_for_chat(chat_id)
+            await self.rate_limiter.acquire(priority)
+        finally:
+            lane.queued -= 1
+        
+        now = time.monotonic()
+        self._chat_next_at[chat_id] = now + self._chat_interval(chat_id)
+        waited = now - started
+        lane.sent += 1
+        lane.wait_total += waited
+        lane.wait_max = max(lane.wait_max, waited)
+        
+        if len(self._chat_next_at) > CHAT_SCHEDULE_PRUNE_SIZE:
+            self._chat_next_at = {chat: at for chat, at in self._chat_next_at.items() if at > now}
+    
+    async def _wait_for_chat(self, chat_id: Union[int, str]):
+        """Соблюсти интервал между сообщениями в один чат"""
+        while True:
+            delay = self._chat_next_at.get(chat_id, 0.0) - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        # Занимаем чат сразу, чтобы параллельные отправки в него ждали следующего интервала
+        self._chat_next_at[chat_id] = time.monotonic() + self._chat_interval(chat_id)
+    
+    def _chat_interval(self, chat_id: Union[int, str]) -> float:
+        """Интервал между сообщениями: личные чаты - положительные ID, группы и каналы - остальные"""
+        if isinstance(chat_id, int) and chat_id > 0:
+            return self.private_interval
+        return self.group_interval
+    
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и время ожидания по полосам, количество flood control"""
+        return {
+            "lanes": {
+                LANE_NAMES.get(priority, str(priority)): lane.as_dict()
+                for priority, lane in sorted(self._lanes.items())
+            },
+            "flood_waits": self.flood_waits,
+        }
+
+
+telegram_session = PrioritySession(
+    rate=TELEGRAM_RATE,
+    burst=TELEGRAM_BURST,
+    private_interval=TELEGRAM_PRIVATE_CHAT_INTERVAL,
+    group_interval=TELEGRAM_GROUP_CHAT_INTERVAL,
+    max_flood_wait=TELEGRAM_MAX_FLOOD_WAIT,
+    flood_retries=TELEGRAM_FLOOD_RETRIES
+)
@@ -4,13 +4,41 @@ from aiogram import Bot
 from aiogram.types import Message
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from utils.cr_api import cr_api
-from config import CLAN_TAG, WAR_REMINDER_HOURS
+from utils.clan_snapshot import clan_snapshot
+from utils.broadcast import broadcaster, BroadcastResult, DELIVERY_BLOCKED
+from utils.rate_limiter import request_priority, PRIORITY_BACKGROUND
+from utils.models import War
+from database import async_db
+from config import (
+    CLAN_TAG, WAR_REMINDER_HOURS, WAR_ATTACKS_RETENTION_DAYS, WAR_COLLECTOR_INTERVAL_WAR,
+    WAR_COLLECTOR_INTERVAL_COLLECTION, WAR_COLLECTOR_INTERVAL_IDLE
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def war_date_of(war_data: War, fetched_at: datetime) -> str:
+    """Ключ дня войны: дата окончания дня битвы по UTC.
+    
+    День битвы не заканчивается в полночь по местному времени, поэтому дата
+    получения снимка разбила бы один день войны на две записи. Дата снимка
+    используется, только если API не вернул warEndTime.
+    """
+    if war_data.war_end_time:
+        return war_data.war_end_time.date().isoformat()
+    logger.warning("В данных войны нет warEndTime, день войны определен по дате снимка")
+    return fetched_at.date().isoformat()
+
+
+async def record_war_attacks(war_data: War, fetched_at: datetime) -> int:
+    """Записать атаки всех участников войны в базу одной транзакцией"""
+    attacks = [(p.key, p.battles_played, p.battles_remaining) for p in war_data.participants]
+    return await async_db.record_war_attacks(war_date_of(war_data, fetched_at), attacks)
+
+
 class WarReminderService:
     """Сервис для напоминаний об атаках в клановой войне"""
     
@@ -18,6 +46,8 @@ class WarReminderService:
         self.bot = bot
         self.scheduler = AsyncIOScheduler()
         self.subscribers: Dict[int, Dict] = {}  # user_id -> {chat_id, player_tag}
+        self._collector_interval = WAR_COLLECTOR_INTERVAL_IDLE
+        self._last_collected_at: Optional[datetime] = None
         self._setup_scheduler()
     
     def _setup_scheduler(self):
@@ -35,6 +65,21 @@ class WarReminderService:
             CronTrigger(hour=23, minute=0),
             id='war_reminder_final'
         )
+        
+        # Сбор атак участников в базу; первый запуск сразу, дальше интервал зависит от фазы войны
+        self.scheduler.add_job(
+            self._collect_war_attacks,
+            IntervalTrigger(seconds=self._collector_interval),
+            id='war_attacks_collector',
+            next_run_time=datetime.now()
+        )
+        
+        # Ночью сворачиваем старую историю атак в итоги по сезонам
+        self.scheduler.add_job(
+            self._compact_war_attacks,
+            CronTrigger(hour=4, minute=30),
+            id='war_attacks_compaction'
+        )
     
     def start(self):
         """Запуск сервиса напоминаний"""
@@ -66,44 +111,111 @@ class WarReminderService:
         """Проверить, подписан ли пользователь"""
         return user_id in self.subscribers
     
+    async def _collect_war_attacks(self):
+        """Записать атаки участников текущей войны и подстроить интервал сбора"""
+        if not CLAN_TAG:
+            return
+        
+        state = None
+        try:
+            # Данные берем из снимка клана - отдельных запросов к API нет
+            war_data = await clan_snapshot.get_war()
+            fetched_at = clan_snapshot.fetched_at("war")
+            if war_data and fetched_at:
+                state = war_data.state
+                # Атаки есть только в день битвы; один и тот же снимок не записываем дважды
+                if state == "warDay" and fetched_at != self._last_collected_at:
+                    recorded = await record_war_attacks(war_data, fetched_at)
+                    self._last_collected_at = fetched_at
+                    logger.debug(f"Записаны атаки {recorded} участников войны")
+        except Exception as e:
+            logger.error(f"Ошибка при сборе атак участников войны: {e}")
+        
+        if state == "warDay":
+            interval = WAR_COLLECTOR_INTERVAL_WAR
+        elif state == "collectionDay":
+            interval = WAR_COLLECTOR_INTERVAL_COLLECTION
+        else:
+            interval = WAR_COLLECTOR_INTERVAL_IDLE
+        
+        if interval != self._collector_interval:
+            self._collector_interval = interval
+            self.scheduler.reschedule_job('war_attacks_collector', trigger=IntervalTrigger(seconds=interval))
+            logger.info(f"Интервал сбора атак: {interval} сек (фаза войны: {state})")
+    
+    async def _compact_war_attacks(self):
+        """Свернуть историю атак старше срока хранения"""
+        try:
+            compacted = await async_db.compact_war_attacks(WAR_ATTACKS_RETENTION_DAYS)
+            if compacted:
+                logger.info(f"История атак: свернуто {compacted} записей старше {WAR_ATTACKS_RETENTION_DAYS} дней")
+        except Exception as e:
+            logger.error(f"Ошибка при сворачивании истории атак: {e}")
+    
     async def _check_and_send_reminders(self):
         """Проверить статус войны и отправить напоминания"""
         if not CLAN_TAG:
             return
         
-        war_data = await cr_api.get_clan_war(CLAN_TAG)
+        # Снимок клана обновляется в фоне - лимит API у команд пользователей не отнимаем
+        war_data = await clan_snapshot.get_war()
         if not war_data:
             return
+        if not self._is_war_fresh():
+            logger.warning("Данные о войне устарели (API недоступен), напоминания не отправлены")
+            return
         
         # Проверяем, есть ли активная война
-        state = war_data.get('state', '').lower()
-        if state not in ['collectionDay', 'warDay']:
+        if not war_data.is_active:
             return
         
         # Формируем сообщение
         message = self._format_war_reminder(war_data)
         
-        # Отправляем напоминания всем подписчикам
-        for user_id, sub_data in self.subscribers.items():
-            try:
-                chat_id = sub_data['chat_id']
-                player_tag = sub_data.get('player_tag')
-                
-                # Если указан тег игрока, проверяем его статус
-                if player_tag:
-                    player_status = await self._check_player_war_status(war_data, player_tag)
-                    if player_status:
-                        message += f"\n\n{player_status}"
-                
-                await self.bot.send_message(chat_id, message, parse_mode="HTML")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке напоминания пользователю {user_id}: {e}")
+        recipients = [{'user_id': user_id, **sub_data} for user_id, sub_data in self.subscribers.items()]
+        # Личные чаты пользователей, недоступных для бота, пропускаем
+        unreachable = await async_db.get_unreachable_ids(
+            r['user_id'] for r in recipients if r['chat_id'] == r['user_id']
+        )
+        recipients = [
+            r for r in recipients if not (r['chat_id'] == r['user_id'] and r['user_id'] in unreachable)
+        ]
+        
+        async def send(recipient: Dict):
+            text = message
+            # Если указан тег игрока, добавляем его статус
+            if recipient.get('player_tag'):
+                player_status = await self._check_player_war_status(war_data, recipient['player_tag'])
+                if player_status:
+                    text += f"\n\n{player_status}"
+            await self.bot.send_message(recipient['chat_id'], text, parse_mode="HTML")
+        
+        async def on_delivered(recipient: Dict, outcome: str, result: BroadcastResult):
+            # Недоступность группового чата ничего не говорит о самом пользователе
+            if outcome == DELIVERY_BLOCKED and recipient['chat_id'] == recipient['user_id']:
+                await async_db.mark_users_unreachable([recipient['user_id']])
+        
+        # Отправляем напоминания подписчикам с учетом лимитов Telegram;
+        # ответы пользователям в очереди Telegram идут впереди напоминаний
+        with request_priority(PRIORITY_BACKGROUND):
+            result = await broadcaster.run(
+                recipients, send, chat_id=lambda r: r['chat_id'], on_delivered=on_delivered
+            )
+        logger.info(
+            f"Напоминания о войне: отправлено {result.sent}, недоступны {result.blocked}, "
+            f"ошибок {result.failed}, пропущено недоступных {len(unreachable)}"
+        )
     
-    def _format_war_reminder(self, war_data: Dict) -> str:
+    @staticmethod
+    def _is_war_fresh() -> bool:
+        """Снимок войны актуален: иначе можно напомнить о дне войны, который уже закончился"""
+        return not clan_snapshot.stale_note("war") and cr_api.breaker.is_closed
+    
+    def _format_war_reminder(self, war_data: War) -> str:
         """Форматирование напоминания о войне"""
-        state = war_data.get('state', 'unknown')
-        clan = war_data.get('clan', {})
-        opponent = war_data.get('opponent', {})
+        state = war_data.state
+        clan = war_data.clan
+        opponent = war_data.opponent
         
         if state == 'collectionDay':
             state_text = "📦 <b>День сбора карт!</b>"
@@ -115,40 +227,36 @@ class WarReminderService:
             return ""
         
         text = f"{state_text}\n\n"
-        text += f"🏰 <b>Ваш клан:</b> {clan.get('name', 'N/A')}\n"
+        text += f"🏰 <b>Ваш клан:</b> {clan.name if clan else 'N/A'}\n"
         
         if opponent:
-            text += f"⚔️ <b>Противник:</b> {opponent.get('name', 'N/A')}\n"
+            text += f"⚔️ <b>Противник:</b> {opponent.name}\n"
         
         text += f"\n{reminder_text}"
         
         # Информация о прогрессе
         if state == 'warDay':
-            clan_crowns = war_data.get('clan', {}).get('crowns', 0)
-            opponent_crowns = war_data.get('opponent', {}).get('crowns', 0)
+            clan_crowns = clan.crowns if clan else 0
+            opponent_crowns = opponent.crowns if opponent else 0
             text += f"\n\n🏆 Счет: {clan_crowns} - {opponent_crowns}"
         
         return text
     
-    async def _check_player_war_status(self, war_data: Dict, player_tag: str) -> Optional[str]:
+    async def _check_player_war_status(self, war_data: War, player_tag: str) -> Optional[str]:
         """Проверить статус игрока в войне"""
         try:
-            # Ищем участника в списке участников войны
-            participants = war_data.get('participants', [])
-            clean_tag = player_tag.replace('#', '').upper()
-            
-            for participant in participants:
-                tag = participant.get('tag', '').replace('#', '').upper()
-                if tag == clean_tag:
-                    name = participant.get('name', 'N/A')
-                    attacks = participant.get('battlesPlayed', 0)
-                    max_attacks = participant.get('battlesPlayed', 0) + participant.get('battlesRemaining', 0)
-                    
-                    if attacks < max_attacks:
-                        remaining = max_attacks - attacks
-                        return f"👤 <b>{name}</b>: Осталось атак: {remaining}/{max_attacks}"
-                    else:
-                        return f"👤 <b>{name}</b>: ✅ Все атаки выполнены!"
+            # Ищем участника по индексу участников войны
+            participant = war_data.participant(player_tag)
+            if participant:
+                name = participant.name
+                attacks = participant.battles_played
+                max_attacks = participant.max_battles
+                
+                if attacks < max_attacks:
+                    remaining = max_attacks - attacks
+                    return f"👤 <b>{name}</b>: Осталось атак: {remaining}/{max_attacks}"
+                else:
+                    return f"👤 <b>{name}</b>: ✅ Все атаки выполнены!"
         except Exception as e:
             logger.error(f"Ошибка при проверке статуса игрока: {e}")
         
@@ -159,9 +267,11 @@ class WarReminderService:
         if not CLAN_TAG:
             return "❌ Тег клана не настроен"
         
-        war_data = await cr_api.get_clan_war(CLAN_TAG)
+        war_data = await clan_snapshot.get_war()
         if not war_data:
             return "❌ Нет активной клановой войны"
+        if not self._is_war_fresh():
+            return "❌ Нет актуальных данных о войне (API недоступен), попробуйте позже"
         
         message = self._format_war_reminder(war_data)
         